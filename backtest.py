@@ -0,0 +1,128 @@
+# backtest.py
+"""
+Array based backtesting of the strategies in main-bot-1.py (Bollinger Bands)
+and main-bot.py (SMA crossover with RSI filter).
+"""
+import numpy as np
+
+import indicators
+
+
+def bollinger_signals(open_time, close, basis, upper, lower, dev, start_ts=None, end_ts=None):
+    """
+    Same rules as generate_signals() in main-bot-1.py, on numpy arrays.
+    Crossovers are found for the whole series at once; only the candles where
+    one of them happens are walked to track the position.
+    Returns a list of trade signals as tuples:
+    (timestamp, action, price, stop_loss, take_profit)
+    """
+    open_time = np.asarray(open_time)
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    if n < 2:
+        return []
+    prev_close, curr_close = close[:-1], close[1:]
+    valid = ~(np.isnan(basis[:-1]) | np.isnan(basis[1:]) | np.isnan(dev[1:])
+              | np.isnan(lower[:-1]) | np.isnan(upper[:-1]))
+    if start_ts is not None:
+        valid &= open_time[1:] >= start_ts
+    if end_ts is not None:
+        valid &= open_time[1:] <= end_ts
+    long_entry = valid & (prev_close <= lower[:-1]) & (curr_close > lower[1:])
+    short_entry = valid & (prev_close >= upper[:-1]) & (curr_close < upper[1:])
+    long_exit = valid & (prev_close >= basis[:-1]) & (curr_close < basis[1:])
+    short_exit = valid & (prev_close <= basis[:-1]) & (curr_close > basis[1:])
+    events = np.flatnonzero(long_entry | short_entry | long_exit | short_exit)
+
+    signals = []
+    position = 0  # 0: no position, 1: long, -1: short
+    for j in events.tolist():
+        i = j + 1
+        if position == 0 and long_entry[j]:
+            signals.append((int(open_time[i]), "Long Entry", float(close[i]),
+                            float(lower[i] - dev[i] * 0.5), float(basis[i] + dev[i] * 1.5)))
+            position = 1
+        elif position == 1 and long_exit[j]:
+            signals.append((int(open_time[i]), "Long Exit", float(close[i]), None, None))
+            position = 0
+        elif position == 0 and short_entry[j]:
+            signals.append((int(open_time[i]), "Short Entry", float(close[i]),
+                            float(upper[i] + dev[i] * 0.5), float(basis[i] - dev[i] * 1.5)))
+            position = -1
+        elif position == -1 and short_exit[j]:
+            signals.append((int(open_time[i]), "Short Exit", float(close[i]), None, None))
+            position = 0
+    return signals
+
+
+def trade_returns(signals, fee=0.0):
+    """
+    Pair entry and exit signals into a numpy array of per-trade returns.
+    `fee` is charged on both entry and exit. A trade still open at the end is ignored.
+    """
+    returns = []
+    entry = None
+    for ts, action, price, stop_loss, take_profit in signals:
+        if action.endswith("Entry"):
+            entry = (action, price)
+        elif entry is not None:
+            side, entry_price = entry
+            if side == "Long Entry":
+                r = price / entry_price - 1.0
+            else:
+                r = 1.0 - price / entry_price
+            returns.append(r - 2 * fee)
+            entry = None
+    return np.asarray(returns, dtype=np.float64)
+
+
+def max_drawdown(returns):
+    """Largest peak to trough drop of the compounded equity curve, as a positive fraction."""
+    if len(returns) == 0:
+        return 0.0
+    equity = np.cumprod(1.0 + np.asarray(returns))
+    peak = np.maximum.accumulate(np.concatenate([[1.0], equity]))[1:]
+    return float(np.max(1.0 - equity / peak))
+
+
+def metrics(returns):
+    """Summary statistics of a series of trade returns."""
+    returns = np.asarray(returns, dtype=np.float64)
+    n = len(returns)
+    std = returns.std(ddof=1) if n > 1 else 0.0
+    return {
+        "trades": n,
+        "total_return": float(np.prod(1.0 + returns) - 1.0) if n else 0.0,
+        "mean_return": float(returns.mean()) if n else 0.0,
+        "sharpe": float(returns.mean() / std * np.sqrt(n)) if std > 0 else 0.0,
+        "max_drawdown": max_drawdown(returns),
+        "win_rate": float((returns > 0).mean()) if n else 0.0,
+    }
+
+
+def run_bollinger(klines, length=20, ma_type="SMA", mult=2.0, start_ts=None, end_ts=None, fee=0.0):
+    """
+    Backtest the Bollinger Band strategy on a dict of kline arrays
+    (see history.KLINE_COLUMNS). Returns (signals, metrics).
+    """
+    basis, upper, lower, dev = indicators.bollinger_bands(
+        klines["close"], length, ma_type, mult, klines["volume"])
+    signals = bollinger_signals(klines["open_time"], klines["close"], basis, upper, lower, dev, start_ts, end_ts)
+    return signals, metrics(trade_returns(signals, fee))
+
+
+def sma_rsi_signals(close, fast_length=9, slow_length=21, rsi_length=14, rsi_overbought=70, rsi_oversold=30):
+    """
+    Signals of the SMA crossover / RSI filter strategy in main-bot.py for every candle.
+    Works on a 1-D series or a (time x symbol) matrix.
+    Returns an int8 array: 1 for long, -1 for short, 0 for no signal.
+    """
+    fast = indicators.sma(close, fast_length)
+    slow = indicators.sma(close, slow_length)
+    rsi = indicators.rsi(close, rsi_length)
+    signals = np.zeros(np.shape(close), dtype=np.int8)
+    long_ = (fast[:-1] < slow[:-1]) & (fast[1:] > slow[1:]) & (rsi[1:] > rsi_oversold)
+    short = (fast[:-1] > slow[:-1]) & (fast[1:] < slow[1:]) & (rsi[1:] < rsi_overbought)
+    signals[1:][long_] = 1
+    signals[1:][short] = -1
+    return signals
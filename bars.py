@@ -0,0 +1,206 @@
+# bars.py
+"""
+Build time, volume and dollar (turnover) bars from a stream of trades.
+
+BarAggregator keeps a fixed handful of numbers per symbol and returns a bar
+the moment a trade crosses its threshold, so strategies can react to bursts
+of activity instead of waiting for the next candle from get_kline.
+
+For recorded trade files, aggregate() builds exactly the same bars from whole
+arrays at once, which is the fast path for replay.
+
+A bar is a tuple:
+(start_ts, end_ts, open, high, low, close, volume, turnover, trades)
+
+Usage: python bars.py TRADES.csv[.gz] time|volume|dollar THRESHOLD
+"""
+import math
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+BAR_KINDS = ("time", "volume", "dollar")
+BAR_FIELDS = ("start_ts", "end_ts", "open", "high", "low", "close", "volume", "turnover", "trades")
+
+
+class BarAggregator:
+    """
+    Incremental bar builder for one symbol.
+    kind "time": threshold is the bar length in ms, bars are aligned to it.
+    kind "volume" / "dollar": a bar closes on the trade that takes the total
+    traded size / turnover past the next multiple of threshold.
+    """
+
+    __slots__ = ("symbol", "kind", "threshold", "on_bar", "bucket", "total", "count",
+                 "start_ts", "end_ts", "open", "high", "low", "close", "volume", "turnover", "trades")
+
+    def __init__(self, symbol: str, kind: str, threshold: float, on_bar=None):
+        if kind not in BAR_KINDS:
+            raise ValueError("Unsupported bar type")
+        self.symbol = symbol
+        self.kind = kind
+        self.threshold = threshold
+        self.on_bar = on_bar
+        self.bucket = None
+        self.total = 0.0
+        self.count = 0
+        self.trades = 0
+
+    def _start(self, ts, price, size):
+        self.start_ts = self.end_ts = ts
+        self.open = self.high = self.low = self.close = price
+        self.volume = size
+        self.turnover = price * size
+        self.trades = 1
+
+    def _emit(self):
+        bar = (self.start_ts, self.end_ts, self.open, self.high, self.low, self.close,
+               self.volume, self.turnover, self.trades)
+        self.trades = 0
+        if self.on_bar is not None:
+            self.on_bar(self.symbol, self.kind, bar)
+        return bar
+
+    def _add(self, ts, price, size):
+        self.end_ts = ts
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += size
+        self.turnover += price * size
+        self.trades += 1
+
+    def update(self, ts: int, price: float, size: float):
+        """Add one trade. Returns the bar it completed, or None."""
+        if self.kind == "time":
+            bucket = ts - ts % self.threshold
+            if bucket == self.bucket and self.trades:
+                self._add(ts, price, size)
+                return None
+            bar = self._emit() if self.trades else None
+            self.bucket = bucket
+            self._start(ts, price, size)
+            return bar
+
+        if self.trades:
+            self._add(ts, price, size)
+        else:
+            self._start(ts, price, size)
+        self.total += size if self.kind == "volume" else price * size
+        count = math.floor(self.total / self.threshold)
+        if count > self.count:
+            self.count = count
+            return self._emit()
+        return None
+
+    def flush(self, now_ms: int):
+        """Close the current time bar if its interval has ended. Returns the bar or None."""
+        if self.kind == "time" and self.trades and now_ms >= self.bucket + self.threshold:
+            return self._emit()
+        return None
+
+
+class BarStream:
+    """
+    Aggregators for many symbols fed from pybit's publicTrade websocket stream.
+    Pass handle_message as the callback of WebSocket.trade_stream().
+    """
+
+    def __init__(self, kind: str, threshold: float, on_bar):
+        self.kind = kind
+        self.threshold = threshold
+        self.on_bar = on_bar
+        self.aggregators = {}
+
+    def aggregator(self, symbol: str) -> BarAggregator:
+        agg = self.aggregators.get(symbol)
+        if agg is None:
+            agg = self.aggregators[symbol] = BarAggregator(symbol, self.kind, self.threshold, self.on_bar)
+        return agg
+
+    def handle_message(self, message: dict):
+        for trade in message.get("data", ()):
+            self.aggregator(trade["s"]).update(int(trade["T"]), float(trade["p"]), float(trade["v"]))
+
+    def flush(self, now_ms: int=None):
+        """Close time bars whose interval has passed; call this from a timer."""
+        now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+        for agg in self.aggregators.values():
+            agg.flush(now_ms)
+
+
+def aggregate(ts, price, size, kind: str, threshold: float) -> dict:
+    """
+    Build the completed bars of a whole trade array at once.
+    Gives the same bars as feeding the trades one by one to BarAggregator
+    (the last, still open bar is left out). Returns a dict of arrays keyed by BAR_FIELDS.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    price = np.asarray(price, dtype=np.float64)
+    size = np.asarray(size, dtype=np.float64)
+    n = len(ts)
+    if kind == "time":
+        bucket = ts - ts % int(threshold)
+        # a bar closes on the last trade before the bucket changes
+        ends = np.flatnonzero(bucket[1:] != bucket[:-1])
+    elif kind in ("volume", "dollar"):
+        amount = size if kind == "volume" else price * size
+        count = np.floor(np.cumsum(amount) / threshold)
+        ends = np.flatnonzero(np.diff(count, prepend=0.0) > 0)
+    else:
+        raise ValueError("Unsupported bar type")
+    if n == 0 or len(ends) == 0:
+        return {name: np.empty(0) for name in BAR_FIELDS}
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    # trades after the last completed bar belong to the open one
+    last = ends[-1] + 1
+    closed_price, closed_size = price[:last], size[:last]
+    return {
+        "start_ts": ts[starts],
+        "end_ts": ts[ends],
+        "open": price[starts],
+        "high": np.maximum.reduceat(closed_price, starts),
+        "low": np.minimum.reduceat(closed_price, starts),
+        "close": price[ends],
+        "volume": np.add.reduceat(closed_size, starts),
+        "turnover": np.add.reduceat(closed_price * closed_size, starts),
+        "trades": ends - starts + 1,
+    }
+
+
+def load_trades(path) -> dict:
+    """
+    Load a Bybit public trade file (public.bybit.com/trading CSV, optionally gzipped).
+    Returns arrays ts (int64 ms), price, size and side (+1 buy, -1 sell), sorted by time.
+    """
+    df = pd.read_csv(path, usecols=["timestamp", "side", "size", "price"])
+    ts = np.round(df["timestamp"].to_numpy(dtype=np.float64) * 1000).astype(np.int64)
+    order = np.argsort(ts, kind="stable")
+    return {
+        "ts": ts[order],
+        "price": df["price"].to_numpy(dtype=np.float64)[order],
+        "size": df["size"].to_numpy(dtype=np.float64)[order],
+        "side": np.where(df["side"].to_numpy() == "Buy", 1, -1)[order],
+    }
+
+
+def main():
+    if len(sys.argv) != 4 or sys.argv[2] not in BAR_KINDS:
+        print("Error: invalid arguments!!\nYou need TRADES_FILE time|volume|dollar THRESHOLD")
+        quit()
+    trades = load_trades(sys.argv[1])
+    threshold = float(sys.argv[3])
+    start = time.perf_counter()
+    bars = aggregate(trades["ts"], trades["price"], trades["size"], sys.argv[2], threshold)
+    elapsed = time.perf_counter() - start
+    n = len(trades["ts"])
+    print(f"{n} trades -> {len(bars['close'])} bars in {elapsed:.3f}s "
+          f"({n / elapsed / 1e6:.1f}M trades/s)" if elapsed > 0 else f"{n} trades")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+# benchmarks.py
+"""
+Benchmarks for indicators, signal generation, kline parsing and the
+tick-to-decision path of the bots, on synthetic OHLCV data.
+
+The bot scripts are loaded with a stubbed session, so nothing touches the
+network. Results are written as JSON and can be compared with a previous run;
+the script exits with status 1 if any benchmark got slower than the threshold.
+
+Usage:
+    python benchmarks.py [--sizes 1k,100k,10M] [--output results.json]
+                         [--compare baseline.json] [--threshold 0.25] [--filter NAME]
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import backtest
+import indicators
+import klines
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# The list based code in the bot scripts is too slow for the largest sizes
+LEGACY_MAX = 100_000
+# Kline responses are lists of strings; larger ones do not fit in memory comfortably
+RESPONSE_MAX = 1_000_000
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    for suffix, mult in (("k", 1_000), ("m", 1_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * mult)
+    return int(text)
+
+
+def synthetic_klines(n: int, seed: int=0) -> dict:
+    """Random walk OHLCV arrays in ascending time order, like history.load_history()."""
+    rng = np.random.default_rng(seed)
+    close = 30000.0 * np.exp(np.cumsum(rng.normal(0.0, 0.001, n)))
+    open_ = np.empty(n)
+    open_[0] = close[0]
+    open_[1:] = close[:-1]
+    spread = np.abs(rng.normal(0.0, 0.0005, n)) * close
+    volume = rng.gamma(2.0, 50.0, n)
+    return {
+        "open_time": 1_600_000_020_000 + np.arange(n, dtype=np.int64) * 60_000,
+        "open": open_,
+        "high": np.maximum(open_, close) + spread,
+        "low": np.minimum(open_, close) - spread,
+        "close": close,
+        "volume": volume,
+        "turnover": volume * close,
+    }
+
+
+def synthetic_kline_response(n: int, seed: int=0) -> dict:
+    """A get_kline response body: rows of strings, newest first, as Bybit returns them."""
+    data = synthetic_klines(n, seed)
+    rows = [[str(int(t)), repr(o), repr(h), repr(l), repr(c), repr(v), repr(q)]
+            for t, o, h, l, c, v, q in zip(*(data[name].tolist() for name in klines.KLINE_COLUMNS))]
+    rows.reverse()
+    return {"retCode": 0, "retMsg": "OK", "result": {"category": "linear", "list": rows}, "time": 0}
+
+
+class StubSession:
+    """Stands in for pybit's HTTP session and answers from synthetic data."""
+
+    def __init__(self, kline_response):
+        self.kline_response = kline_response
+
+    def get_kline(self, **kwargs):
+        # the scripts sort or modify the list, so hand out a fresh copy each time
+        result = dict(self.kline_response["result"], list=list(self.kline_response["result"]["list"]))
+        return dict(self.kline_response, result=result)
+
+    def get_positions(self, **kwargs):
+        return {"retCode": 0, "result": {"list": [{"symbol": kwargs.get("symbol"), "side": "Buy",
+                                                    "size": "0", "leverage": "10"}]}}
+
+    def get_wallet_balance(self, **kwargs):
+        return {"retCode": 0, "result": {"list": [{"totalEquity": "10000", "coin": []}]}}
+
+    def place_order(self, **kwargs):
+        return {"retCode": 0, "result": {"orderId": "stub", "orderLinkId": ""}}
+
+
+def legacy_kline_frame(rows):
+    """The DataFrame based kline parsing main-bot.py used before klines.py."""
+    df = pd.DataFrame(rows, columns=list(klines.KLINE_COLUMNS))
+    df['open_time'] = pd.to_datetime(df['open_time'].astype(float), unit='ms')
+    df.set_index('open_time', inplace=True)
+    return df.astype(float)
+
+
+def load_script(filename: str, argv=None):
+    """Import one of the bot scripts (their names are not valid module names)."""
+    path = os.path.join(HERE, filename)
+    name = "bench_" + os.path.splitext(filename)[0].replace("-", "_")
+    old_argv = sys.argv
+    sys.argv = [path] + list(argv or [])
+    try:
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = old_argv
+    return module
+
+
+def measure(fn, min_time=0.2, max_repeat=20) -> float:
+    """Best time of several runs of fn(), in seconds."""
+    best = float("inf")
+    spent = 0.0
+    for _ in range(max_repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= min_time:
+            break
+    return best
+
+
+def build_cases(n: int):
+    """Yield (name, fn) for every benchmark that applies to size n."""
+    data = synthetic_klines(n)
+    close, volume = data["close"], data["volume"]
+
+    for ma_type in indicators.MA_TYPES:
+        yield f"indicators.moving_average[{ma_type}]", lambda t=ma_type: indicators.moving_average(close, 20, t, volume)
+    yield "indicators.rolling_std", lambda: indicators.rolling_std(close, 20)
+    yield "indicators.rsi", lambda: indicators.rsi(close, 14)
+    bands = indicators.bollinger_bands(close, 20, "SMA", 2.0, volume)
+    yield "indicators.bollinger_bands", lambda: indicators.bollinger_bands(close, 20, "SMA", 2.0, volume)
+    yield "backtest.bollinger_signals", lambda: backtest.bollinger_signals(data["open_time"], close, *bands)
+    yield "backtest.sma_rsi_signals", lambda: backtest.sma_rsi_signals(close)
+
+    if n <= RESPONSE_MAX:
+        response = synthetic_kline_response(n)
+        rows = response["result"]["list"]
+        body = json.dumps(response, separators=(",", ":")).encode()
+        yield "legacy.kline_dataframe", lambda: legacy_kline_frame(rows)
+        yield "klines.parse_kline_rows", lambda: klines.parse_kline_rows(rows)
+        yield "klines.decode_kline_body", lambda: klines.decode_kline_body(body)
+        session = StubSession(response)
+        bot = load_script("main-bot.py", ["BTCUSDT", "0.01", "1"])
+        bot.session = session
+        yield "main-bot.fetch_klines", lambda: bot.fetch_klines("BTCUSDT", "1", limit=n)
+        df = bot.calculate_indicators(bot.fetch_klines("BTCUSDT", "1", limit=n))
+        yield "main-bot.calculate_indicators", lambda: bot.calculate_indicators(df.copy())
+        yield "main-bot.generate_signals", lambda: bot.generate_signals(df)
+
+        def decision():
+            frame = bot.fetch_klines("BTCUSDT", "1", limit=n)
+            frame = bot.calculate_indicators(frame)
+            return bot.generate_signals(frame), bot.get_open_position()
+        yield "main-bot.tick_to_decision", decision
+
+    if n <= LEGACY_MAX:
+        bot1 = load_script("main-bot-1.py")
+        bot1.session = StubSession(response)
+        candles = bot1.fetch_klines("BTCUSDT", "15", limit=n)
+        closes = [k["close"] for k in candles]
+        volumes = [k["volume"] for k in candles]
+        yield "main-bot-1.fetch_klines", lambda: bot1.fetch_klines("BTCUSDT", "15", limit=n)
+        for ma_type in indicators.MA_TYPES:
+            yield f"main-bot-1.moving_average[{ma_type}]", lambda t=ma_type: bot1.moving_average(closes, 20, t, volumes)
+        yield "main-bot-1.calculate_stdev", lambda: bot1.calculate_stdev(closes, 20)
+        yield "main-bot-1.calculate_bollinger_bands", lambda: bot1.calculate_bollinger_bands(candles, 20, "SMA", 2.0)
+        lists = bot1.calculate_bollinger_bands(candles, 20, "SMA", 2.0)
+        end = candles[-1]["open_time"]
+        yield "main-bot-1.generate_signals", lambda: bot1.generate_signals(candles, *lists, 0, end)
+
+        def decision1():
+            k = bot1.fetch_klines("BTCUSDT", "15", limit=n)
+            b = bot1.calculate_bollinger_bands(k, 20, "SMA", 2.0)
+            return bot1.generate_signals(k, *b, 0, k[-1]["open_time"])
+        yield "main-bot-1.tick_to_decision", decision1
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+    }
+
+
+def run(sizes, name_filter=None) -> dict:
+    results = {}
+    for n in sizes:
+        for name, fn in build_cases(n):
+            if name_filter and name_filter not in name:
+                continue
+            seconds = measure(fn)
+            results.setdefault(name, {})[str(n)] = seconds
+            print(f"{name:45s} {n:>10d} bars  {seconds * 1e3:12.3f} ms")
+    return {"environment": environment(), "results": results}
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Return (name, size, baseline, current) for every result slower than baseline * (1 + threshold)."""
+    regressions = []
+    for name, by_size in current["results"].items():
+        for size, seconds in by_size.items():
+            old = baseline["results"].get(name, {}).get(size)
+            if old is not None and seconds > old * (1.0 + threshold):
+                regressions.append((name, size, old, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark indicators, signals and kline parsing.")
+    parser.add_argument("--sizes", default="1k,100k", help="comma separated bar counts, e.g. 1k,100k,10M")
+    parser.add_argument("--output", default="bench_output.json", help="where to write the results")
+    parser.add_argument("--compare", help="previous results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--filter", help="only run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    sizes = [parse_size(s) for s in args.sizes.split(",")]
+    current = run(sizes, args.filter)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        for name, size, old, new in regressions:
+            print(f"REGRESSION {name} [{size} bars]: {old * 1e3:.3f} ms -> {new * 1e3:.3f} ms")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,16 +5,39 @@ from dotenv import load_dotenv
 from time import time
 
 from utils import get_position_info
+from instruments import InstrumentCache
+from risk import RiskEngine
+from clocksync import ClockSync
+from hedging import HedgedSession
+from orders import OrderManager
+import capture
+import profiling
 
 # Load environment variables
 load_dotenv()
 
 # Initialize the Bybit session
-session = HTTP(
+# Slow reads are hedged and orders carry an orderLinkId so they can be retried safely
+# With CAPTURE_RECORD / CAPTURE_REPLAY set, the session is recorded to or replayed from a capture file
+session = capture.from_env(lambda: HedgedSession(HTTP(
     testnet=False,
     api_key=os.getenv("BYBIT_API_KEY"),
     api_secret=os.getenv("BYBIT_API_SECRET")
-)
+)))
+
+# Pre-trade risk limits, checked locally before every order
+risk = RiskEngine()
+# Tick size / qty step of every linear symbol, used to round orders
+instruments = InstrumentCache(session)
+# Per stage CPU time, allocations and sampled stacks (flame graph) when PROFILE=1
+profiler = profiling.from_env("bot")
+# Sends orders in the background and follows them through acks and fills
+# Fills move the risk engine's positions
+# A replay places orders one at a time, so they take the capture's records in a fixed order
+order_manager = OrderManager(session, max_workers=1 if isinstance(session, capture.ReplaySession) else 8,
+                             on_fill=lambda order, qty, price: risk.on_fill(order.symbol, order.side, qty, price))
+# Signs requests with server time instead of the local clock
+clock = session.clock() if isinstance(session, capture.ReplaySession) else ClockSync(session)
 
 def get_last_price(symbol):
     """Fetch the last price of a symbol."""
@@ -50,19 +73,25 @@ def place_market_order(symbol, side, qty):
     return order
 
 def place_limit_order(symbol:str, side:str, price: float, qty, lev:str, usdt: bool=False):
-    """Place a market order."""
-    set_levrege(symbol, lev)
+    """Place a limit order. With usdt=True, qty is the order value in USDT."""
     if usdt:
-        x = "{:.2f}".format(qty / float(price))
-        if x == "0.00": x = "{:.3f}".format(qty / float(price))
-        qty = x
-    order = session.place_order(
+        qty = qty / float(price)
+    qty, price, reason = instruments.prepare_order(symbol, qty, price)
+    if reason:
+        print(f"Order rejected: {reason}")
+        return None
+    reason = risk.check_order(symbol, side, qty, price=price, lev=lev)
+    if reason:
+        print(f"Order rejected by risk check: {reason}")
+        return None
+    set_levrege(symbol, lev)
+    order = order_manager.submit(
         category="linear",
         symbol=symbol,
         side=side,
         orderType="Limit",
         qty=qty,
-        price=str(price),
+        price=price,
         timeInForce="GTC",
         isLeverage=0,
     )
@@ -88,21 +117,45 @@ def get_orders(symbol: str=None) -> list:
 
     return orders
 
-def cancel_order(symbol: str, id: str) -> dict:
-    """Gets all orders of a coin.
-    if a Symbol is None, it return for all coins. """
+def cancel_order(symbol: str, id: str):
+    """Cancels an order by its orderId without waiting for the exchange and returns the tracked order.
+    Without a symbol the order manager cannot track it, so it is cancelled with a plain REST call. """
     if symbol=="": symbol = None
-    res = session.cancel_order(
-        category="linear",
-        symbol=symbol,
-        orderId=id,
-    )
-    return res
+    order = order_manager.cancel(id, symbol)
+    if order is None:
+        return session.cancel_order(
+            category="linear",
+            symbol=symbol,
+            orderId=id,
+        )
+    return order
+
+profiler.instrument(globals(), "get_last_price", "set_levrege", "place_market_order", "place_limit_order",
+                    "get_orders", "cancel_order")
+profiler.instrument(session, "get_mark_price_kline", "get_positions", "set_leverage", "place_order",
+                    "get_open_orders", "cancel_order", prefix="network.")
 
 def main():
     symbol = "BTCUSDT"
     side = "Sell"  # "Buy" or "Sell"
     qty = "0.1"  # Amount of tokens to buy
+    # A replay refreshes the risk engine once here instead of in background threads,
+    # so every run draws the same records of the capture in the same order
+    if isinstance(session, capture.ReplaySession):
+        try:
+            risk.refresh(session)
+        except Exception as e:
+            print(f"Exception in replayed refresh: {e}")
+    else:
+        risk.start(session)
+        order_manager.start()
+    clock.start()
+    # private order / execution pushes; without them the order manager polls stale orders
+    if not capture.enabled():
+        try:
+            order_manager.connect(api_key=os.getenv("BYBIT_API_KEY"), api_secret=os.getenv("BYBIT_API_SECRET"))
+        except Exception as e:
+            print(f"Could not connect the private websocket: {e}")
 
     # Get the last price
     last_price = get_last_price(symbol)
@@ -110,7 +163,10 @@ def main():
 
     # Place a limit order
     order = place_limit_order(symbol, side, 88000, 100, "50", True)
-    print(f"Order placed: {order}")
+    print(f"Order submitted: {order}")
+    if order is not None:
+        order_manager.wait(order, timeout=5, acked=True)
+        print(f"Order state: {order}")
 
 if __name__ == "__main__":
     # main()
@@ -0,0 +1,284 @@
+# cache.py
+"""
+Content-addressed cache for indicator arrays and backtest results.
+
+Keys are hashes of the input kline arrays, the parameters and the source of
+the code that computes the result, so a changed candle, parameter or
+function never returns a stale value. Results live in an in-memory LRU and
+in .npz files on disk; the oldest files are removed when the disk tier
+grows past its size limit.
+
+Indicators are causal, so when candles are appended to a history whose
+bands are cached, only the new rows are computed (plus the lookback of the
+window, or from the last value for EMA / RMA). Windowed indicators (SMA,
+WMA, VWMA, standard deviation) also reuse the rows of a cached window that
+has since slid forward, as the "last N candles" a bot fetches every loop do.
+The reused bands equal a full recomputation up to float rounding.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import backtest
+import indicators
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(HERE, ".cache")
+
+_META = "__meta__"
+
+# how many of the newest candles are tried as the last one of a cached window
+SLIDE_ROWS = 64
+
+
+def hash_arrays(*arrays) -> str:
+    # sha256 is the fastest hashlib digest on CPUs with SHA extensions
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f"{a.dtype.str}{a.shape}".encode())
+        h.update(a.data)
+    return h.hexdigest()[:40]
+
+
+def code_version(*paths) -> str:
+    """Hash of the source files that compute a result."""
+    h = hashlib.blake2b(digest_size=12)
+    for path in paths:
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def make_key(*parts) -> str:
+    return hashlib.blake2b(json.dumps(parts, sort_keys=True, default=str).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    Two tier cache of results, each a dict of numpy arrays plus a JSON-able
+    'meta' dict. `memory_items` results are kept in memory, and up to
+    `disk_bytes` of .npz files under `path`.
+    """
+
+    def __init__(self, path: str=DEFAULT_PATH, memory_items: int=64, disk_bytes: int=1 << 30):
+        self.path = path
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._disk_size = None
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + ".npz")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self.memory[key] = value
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def get(self, key):
+        """(arrays, meta) or None."""
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return value
+        path = self._file(key)
+        try:
+            with np.load(path) as f:
+                arrays = {name: f[name] for name in f.files if name != _META}
+                meta = json.loads(str(f[_META]))
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        value = (arrays, meta)
+        self._remember(key, value)
+        return value
+
+    def put(self, key, arrays: dict, meta: dict=None):
+        value = (arrays, meta or {})
+        self._remember(key, value)
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp.npz"
+        try:
+            np.savez(tmp, **{_META: np.array(json.dumps(value[1]))}, **arrays)
+            os.replace(tmp, path)
+            if self._disk_size is not None:
+                self._disk_size += os.path.getsize(path)
+            self._evict()
+        except OSError as e:
+            logging.error("Could not write cache entry %s: %s", path, e)
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                if name.endswith(".npz") and not name.endswith(".tmp.npz"):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        """Remove the least recently used files until the disk tier fits in disk_bytes."""
+        if self._disk_size is not None and self._disk_size <= self.disk_bytes:
+            return
+        entries = self._entries()
+        self._disk_size = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if self._disk_size <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                self._disk_size -= size
+            except OSError:
+                pass
+
+    def clear_memory(self):
+        with self._lock:
+            self.memory.clear()
+
+
+_INDICATORS_VERSION = code_version(os.path.join(HERE, "indicators.py"))
+_BACKTEST_VERSION = code_version(os.path.join(HERE, "indicators.py"), os.path.join(HERE, "backtest.py"))
+
+
+def _window_key(params, t, inputs, j):
+    # the candle before the last one is closed, so a window whose forming candle changed since is still found
+    before = [float(values[j - 1]) for values in inputs.values()] if j > 0 else None
+    return make_key(params, "window", int(t[j]), before)
+
+
+def windowed(cache: ResultCache, params, t, inputs: dict, compute, lookback: int, max_new_rows: int=SLIDE_ROWS) -> dict:
+    """
+    compute(inputs) through the cache, for a result of one value per row
+    that only depends on the `lookback` rows up to it (NaN before that).
+    `inputs` is a dict of arrays aligned with the open times `t`, `compute`
+    returns a dict of arrays. A cached window that overlaps this one and
+    ends at most `max_new_rows` rows before it is reused, and only the rows
+    after the overlap (or after the first changed row) are computed.
+    """
+    t = np.asarray(t, dtype=np.int64)
+    rows = len(t)
+    if rows == 0:
+        return compute(inputs)
+    out = None
+    for j in range(rows - 1, max(-1, rows - 2 - max_new_rows), -1):
+        hit = cache.get(_window_key(params, t, inputs, j))
+        if hit is None or "open_time" not in hit[0]:
+            continue
+        old = hit[0]
+        s = len(old["open_time"]) - (j + 1)
+        if s < 0 or not np.array_equal(old["open_time"][s:], t[:j + 1]):
+            continue
+        same = np.ones(j + 1, dtype=bool)
+        for name, values in inputs.items():
+            same &= old[name][s:] == values[:j + 1]
+        k = j + 1 if same.all() else int(np.argmin(same))
+        if k < lookback:
+            continue
+        start = k - lookback + 1
+        new = compute({name: values[start:] for name, values in inputs.items()}) if k < rows else None
+        out = {}
+        for name in old:
+            if name == "open_time" or name in inputs:
+                continue
+            values = old[name][s:s + k].copy()
+            if s:
+                # rows before the first full window of this one are NaN, as if computed from scratch
+                values[:lookback - 1] = np.nan
+            out[name] = np.concatenate([values, new[name][k - start:]]) if new is not None else values
+        break
+    if out is None:
+        out = compute(inputs)
+    cache.put(_window_key(params, t, inputs, rows - 1), dict(out, open_time=t, **inputs))
+    return out
+
+
+def _extend_bands(close, old, n, length, ma_type, mult):
+    """EMA / RMA bands of close[n:] given the bands `old` of close[:n]."""
+    if n < length or np.isnan(old["basis"][n - 1]):
+        return None
+    alpha = 2.0 / (length + 1) if ma_type == "EMA" else 1.0 / length
+    basis = indicators.ewm(close[n:], alpha, init=old["basis"][n - 1])
+    s = max(0, n - length + 1)
+    dev = indicators.rolling_std(close[s:], length)[n - s:] * mult
+    return {
+        "basis": np.concatenate([old["basis"], basis]),
+        "upper": np.concatenate([old["upper"], basis + dev]),
+        "lower": np.concatenate([old["lower"], basis - dev]),
+        "dev": np.concatenate([old["dev"], dev]),
+    }
+
+
+def bollinger_bands(cache: ResultCache, klines: dict, length=20, ma_type="SMA", mult=2.0):
+    """
+    indicators.bollinger_bands() of a dict of kline arrays, through the cache.
+    Returns basis, upper, lower, dev.
+    """
+    close = np.asarray(klines["close"], dtype=np.float64)
+    volume = np.asarray(klines["volume"], dtype=np.float64)
+    t = np.asarray(klines["open_time"], dtype=np.int64)
+    params = ("bollinger_bands", length, ma_type, float(mult), _INDICATORS_VERSION)
+    if ma_type in ("SMA", "WMA", "VWMA"):
+        def compute(rows):
+            return dict(zip(("basis", "upper", "lower", "dev"),
+                            indicators.bollinger_bands(rows["close"], length, ma_type, mult, rows.get("volume"))))
+        columns = {"close": close, "volume": volume} if ma_type == "VWMA" else {"close": close}
+        bands = windowed(cache, params, t, columns, compute, length)
+        return bands["basis"], bands["upper"], bands["lower"], bands["dev"]
+    inputs = (t, close)
+    data = hash_arrays(*inputs)
+    key = make_key(params, data)
+    hit = cache.get(key)
+    if hit is None:
+        bands = None
+        # the newest cached result for a history with the same first candle
+        prefix_key = make_key(params, "prefix", int(t[0]) if len(t) else None)
+        prefix = cache.get(prefix_key)
+        if prefix is not None:
+            n = prefix[1]["rows"]
+            if 0 < n < len(t) and hash_arrays(*(a[:n] for a in inputs)) == prefix[1]["data"]:
+                old = cache.get(prefix[1]["key"])
+                if old is not None:
+                    bands = _extend_bands(close, old[0], n, length, ma_type, mult)
+        if bands is None:
+            basis, upper, lower, dev = indicators.bollinger_bands(close, length, ma_type, mult, volume)
+            bands = {"basis": basis, "upper": upper, "lower": lower, "dev": dev}
+        cache.put(key, bands, {"rows": len(t)})
+        cache.put(prefix_key, {}, {"key": key, "rows": len(t), "data": data})
+        hit = (bands, None)
+    bands = hit[0]
+    return bands["basis"], bands["upper"], bands["lower"], bands["dev"]
+
+
+def run_bollinger(cache: ResultCache, klines: dict, length=20, ma_type="SMA", mult=2.0,
+                  start_ts=None, end_ts=None, fee=0.0) -> dict:
+    """backtest.run_bollinger() metrics through the cache (bands come from bollinger_bands())."""
+    close = np.asarray(klines["close"], dtype=np.float64)
+    t = np.asarray(klines["open_time"], dtype=np.int64)
+    key = make_key("run_bollinger", length, ma_type, float(mult), start_ts, end_ts, float(fee), _BACKTEST_VERSION,
+                   hash_arrays(t, close, np.asarray(klines["volume"], dtype=np.float64)))
+    hit = cache.get(key)
+    if hit is not None:
+        return hit[1]["metrics"]
+    bands = bollinger_bands(cache, klines, length, ma_type, mult)
+    signals = backtest.bollinger_signals(t, close, *bands, start_ts, end_ts)
+    result = backtest.metrics(backtest.trade_returns(signals, fee))
+    result = {k: (float(v) if isinstance(v, (float, np.floating)) else int(v) if isinstance(v, (int, np.integer)) else v)
+              for k, v in result.items()}
+    cache.put(key, {}, {"metrics": result, "signals": len(signals)})
+    return result
@@ -0,0 +1,486 @@
+# capture.py
+"""
+Record the requests and responses of a pybit session and replay them.
+
+RecordingSession wraps a session and appends every API call (method,
+arguments, response or error, start time and latency) to a capture file.
+ReplaySession answers the same calls from that file without a network, at
+the recorded speed or as fast as possible, so a run of a bot can be
+repeated offline with the exact responses it got.
+
+A capture file is a series of zlib compressed blocks of JSON lines, followed
+by an index of the blocks (offset, record count, first start time) and a
+footer pointing at the index. A file whose writer died has no index; the
+reader then rebuilds it by scanning the blocks.
+
+    CAPTURE_RECORD=run.cap python main-bot.py BTCUSDT 0.01 1
+    CAPTURE_REPLAY=run.cap CAPTURE_SPEED=0 python main-bot.py BTCUSDT 0.01 1
+
+CAPTURE_SPEED is a multiple of the recorded speed, 0 replays as fast as possible.
+"""
+import atexit
+import builtins
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+import numpy as np
+
+MAGIC = b"BYCAPv1\n"
+FOOTER_MAGIC = b"BYCAPIDX"
+_FRAME = struct.Struct("<I")
+_FOOTER = struct.Struct("<Q8s")
+
+# Public callables of pybit / HedgedSession that are not API calls
+_NOT_RECORDED = {"prepare_payload", "prepare_file_payload", "report", "log_report", "hedge_delay"}
+
+# Arguments that differ on every run and are ignored when matching a call to a record
+VOLATILE_ARGS = ("orderLinkId", "order_link_id")
+
+
+def _json(value) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def call_key(method: str, kwargs: dict, ignore=VOLATILE_ARGS) -> str:
+    """Identifies a call for matching: method and arguments, without the volatile ones."""
+    args = {k: v for k, v in kwargs.items() if k not in ignore}
+    return method + json.dumps(args, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class CaptureWriter:
+    """
+    Appends records to a capture file. A block is compressed and written once
+    it has `block_records` records or is `flush_interval` seconds old.
+    """
+
+    def __init__(self, path: str, block_records: int=256, flush_interval: float=60.0, level: int=6):
+        self.level = level
+        self.path = path
+        self.block_records = block_records
+        self.flush_interval = flush_interval
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.blocks = []  # [offset, records, first seq, first start time]
+        self.methods = {}
+        self.records = 0
+        self.raw_bytes = 0
+        self._block = []
+        self._block_started = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def append(self, record: dict):
+        line = _json(record).encode()
+        with self._lock:
+            if self.file is None:
+                return
+            if not self._block:
+                self._block_started = time.monotonic()
+                self.blocks.append([None, 0, record["seq"], record["start"]])
+            self._block.append(line)
+            self.records += 1
+            self.methods[record["method"]] = self.methods.get(record["method"], 0) + 1
+            if (len(self._block) >= self.block_records
+                    or time.monotonic() - self._block_started >= self.flush_interval):
+                self._write_block()
+
+    def _write_block(self):
+        if not self._block:
+            return
+        data = b"\n".join(self._block)
+        self.raw_bytes += len(data)
+        block = self.blocks[-1]
+        block[0] = self.file.tell()
+        block[1] = len(self._block)
+        self._write_frame(zlib.compress(data, self.level))
+        self.file.flush()
+        self._block = []
+
+    def _write_frame(self, payload: bytes):
+        self.file.write(_FRAME.pack(len(payload)))
+        self.file.write(payload)
+
+    def flush(self):
+        with self._lock:
+            if self.file is not None:
+                self._write_block()
+
+    def close(self):
+        with self._lock:
+            if self.file is None:
+                return
+            self._write_block()
+            offset = self.file.tell()
+            index = {"blocks": self.blocks, "records": self.records, "methods": self.methods,
+                     "raw_bytes": self.raw_bytes}
+            self._write_frame(zlib.compress(_json(index).encode(), self.level))
+            self.file.write(_FOOTER.pack(offset, FOOTER_MAGIC))
+            self.file.close()
+            self.file = None
+        atexit.unregister(self.close)
+
+
+class CaptureReader:
+    """Random access to the records of a capture file."""
+
+    def __init__(self, path: str, cached_blocks: int=4):
+        self.path = path
+        self.file = open(path, "rb")
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        self.cached_blocks = cached_blocks
+        self._cache = OrderedDict()
+        self.complete = True
+        try:
+            index = self._read_index()
+        except ValueError:
+            self.complete = False
+            index = self._scan()
+        self.blocks = index["blocks"]
+        self.methods = index["methods"]
+        self.raw_bytes = index.get("raw_bytes")
+        self._starts = np.cumsum([0] + [b[1] for b in self.blocks])
+
+    def _read_frame(self, offset: int) -> bytes:
+        self.file.seek(offset)
+        header = self.file.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            raise ValueError("Truncated frame")
+        length, = _FRAME.unpack(header)
+        payload = self.file.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated frame")
+        return zlib.decompress(payload)
+
+    def _read_index(self) -> dict:
+        size = self.file.seek(0, os.SEEK_END)
+        if size < len(MAGIC) + _FOOTER.size:
+            raise ValueError("No index")
+        self.file.seek(size - _FOOTER.size)
+        offset, magic = _FOOTER.unpack(self.file.read(_FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError("No index")
+        return json.loads(self._read_frame(offset))
+
+    def _scan(self) -> dict:
+        """Index of a file without footer, up to its last complete block."""
+        logging.warning("%s has no index, scanning it", self.path)
+        blocks, methods = [], {}
+        offset = len(MAGIC)
+        while True:
+            try:
+                records = [json.loads(line) for line in self._read_frame(offset).split(b"\n")]
+            except (ValueError, zlib.error):
+                break
+            if "seq" not in records[0]:
+                break  # the index frame of a file that lost its footer
+            blocks.append([offset, len(records), records[0]["seq"], records[0]["start"]])
+            for record in records:
+                methods[record["method"]] = methods.get(record["method"], 0) + 1
+            offset = self.file.tell()
+        return {"blocks": blocks, "methods": methods}
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def block(self, i: int) -> list:
+        records = self._cache.get(i)
+        if records is None:
+            records = [json.loads(line) for line in self._read_frame(self.blocks[i][0]).split(b"\n")]
+            self._cache[i] = records
+            while len(self._cache) > self.cached_blocks:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(i)
+        return records
+
+    def __getitem__(self, n: int) -> dict:
+        if n < 0:
+            n += len(self)
+        if not 0 <= n < len(self):
+            raise IndexError(n)
+        i = int(np.searchsorted(self._starts, n, side="right")) - 1
+        return self.block(i)[n - self._starts[i]]
+
+    def __iter__(self):
+        for i in range(len(self.blocks)):
+            yield from self.block(i)
+
+    def records(self, method: str=None, start: float=None, end: float=None):
+        """Records of one method and/or with start time in [start, end); the index skips other blocks."""
+        first = 0
+        if start is not None:
+            first = max(0, int(np.searchsorted([b[3] for b in self.blocks], start, side="right")) - 1)
+        for i in range(first, len(self.blocks)):
+            if end is not None and self.blocks[i][3] >= end:
+                return
+            for record in self.block(i):
+                if method is not None and record["method"] != method:
+                    continue
+                if start is not None and record["start"] < start:
+                    continue
+                if end is not None and record["start"] >= end:
+                    return
+                yield record
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingSession:
+    """Wraps a session and records every API call to a capture file."""
+
+    def __init__(self, session, path: str, **writer_options):
+        self.session = session
+        self.writer = CaptureWriter(path, **writer_options)
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.session, name)
+        if name.startswith("_") or name in _NOT_RECORDED or not callable(attr):
+            return attr
+        return lambda **kwargs: self._call(name, attr, kwargs)
+
+    def _call(self, name, fn, kwargs):
+        with self._seq_lock:
+            seq = self._seq
+            self._seq += 1
+        record = {"seq": seq, "method": name, "kwargs": kwargs, "thread": threading.current_thread().name,
+                  "start": time.time()}
+        t0 = time.perf_counter()
+        try:
+            result = fn(**kwargs)
+        except Exception as e:
+            record["ms"] = (time.perf_counter() - t0) * 1000
+            record["error"] = {"type": type(e).__name__, "message": getattr(e, "message", str(e)),
+                               "status_code": getattr(e, "status_code", None)}
+            self.writer.append(record)
+            raise
+        record["ms"] = (time.perf_counter() - t0) * 1000
+        record["response"] = result
+        self.writer.append(record)
+        return result
+
+    def close(self):
+        self.writer.close()
+
+
+class ReplayMismatch(Exception):
+    """A call that is not in the capture."""
+
+
+class ReplayExhausted(Exception):
+    """All records of a call were used. ReplaySession.exhausted is set too, for loops that catch every error."""
+
+
+def _replayed_error(error: dict) -> Exception:
+    from pybit import exceptions
+    cls = getattr(exceptions, error["type"], None)
+    if cls in (exceptions.InvalidRequestError, exceptions.FailedRequestError):
+        return cls(request="replayed", message=error["message"], status_code=error["status_code"],
+                   time=None, resp_headers=None)
+    builtin = getattr(builtins, error["type"], None)
+    if isinstance(builtin, type) and issubclass(builtin, Exception):
+        return builtin(error["message"])
+    return RuntimeError(f"{error['type']}: {error['message']}")
+
+
+class ReplaySession:
+    """
+    Answers API calls from a capture file. Calls are matched to records by
+    method and arguments (without VOLATILE_ARGS) and each match is used in
+    recorded order. A call with arguments that were never recorded gets the
+    next record of the same method, or raises ReplayMismatch when strict.
+
+    Replay runs on a virtual clock that starts at the first recorded call.
+    A call waits until the time its response arrived in the recording, and
+    clock() gives a ClockSync stand-in on the same virtual time. With speed
+    0 nothing waits and the virtual clock just jumps ahead.
+    """
+
+    def __init__(self, path: str, speed: float=1.0, strict: bool=False, ignore=VOLATILE_ARGS):
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.strict = strict
+        self.ignore = ignore
+        self.by_key = {}
+        self.by_method = {}
+        for n, record in enumerate(self.reader):
+            record["_n"] = n
+            self.by_key.setdefault(call_key(record["method"], record["kwargs"], ignore), deque()).append(record)
+            self.by_method.setdefault(record["method"], deque()).append(record)
+        self.used = set()
+        self.calls = self.mismatches = 0
+        self.exhausted = False
+        first = self.reader[0]["start"] * 1000 if len(self.reader) else time.time() * 1000
+        self.now = first
+        self._anchor = (time.perf_counter(), first)
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name not in self.by_method and not self._is_api(name):
+            raise AttributeError(name)
+        return lambda **kwargs: self._call(name, kwargs)
+
+    @staticmethod
+    def _is_api(name) -> bool:
+        from pybit.unified_trading import HTTP
+        return callable(getattr(HTTP, name, None)) and name not in _NOT_RECORDED
+
+    def _next(self, queue):
+        while queue and queue[0]["_n"] in self.used:
+            queue.popleft()
+        if not queue:
+            return None
+        record = queue.popleft()
+        self.used.add(record["_n"])
+        return record
+
+    def _call(self, name, kwargs):
+        key = call_key(name, kwargs, self.ignore)
+        with self._lock:
+            self.calls += 1
+            record = self._next(self.by_key.get(key, deque()))
+            if record is None and key not in self.by_key:
+                self.mismatches += 1
+                if self.strict:
+                    raise ReplayMismatch(f"{name}({kwargs}) was not recorded")
+                record = self._next(self.by_method.get(name, deque()))
+                if record is not None:
+                    logging.warning("%s(%s) was not recorded, replaying the record of %s instead", name, kwargs,
+                                    record["kwargs"])
+            if record is None:
+                self.exhausted = True
+                raise ReplayExhausted(f"No more records of {name} in {self.reader.path}")
+        self.advance(record["start"] * 1000 + record["ms"])
+        if "error" in record:
+            raise _replayed_error(record["error"])
+        return record["response"]
+
+    def advance(self, ms: float):
+        """Move the virtual clock to ms, waiting for it unless replaying as fast as possible."""
+        with self._lock:
+            if ms <= self.now:
+                return
+            self.now = ms
+        if self.speed:
+            real, virtual = self._anchor
+            remaining = real + (ms - virtual) / 1000 / self.speed - time.perf_counter()
+            if remaining > 0:
+                time.sleep(remaining)
+
+    def now_ms(self) -> int:
+        if self.speed:
+            real, virtual = self._anchor
+            return int(max(self.now, virtual + (time.perf_counter() - real) * 1000 * self.speed))
+        return int(self.now)
+
+    def clock(self):
+        return ReplayClock(self)
+
+    def report(self) -> dict:
+        return {"records": len(self.reader), "used": len(self.used), "calls": self.calls,
+                "mismatches": self.mismatches}
+
+    def log_report(self):
+        r = self.report()
+        logging.info("Replay: %d calls, %d of %d records used, %d mismatches", r["calls"], r["used"],
+                     r["records"], r["mismatches"])
+
+
+class ReplayClock:
+    """The parts of clocksync.ClockSync the bots use, on the virtual time of a replay."""
+
+    def __init__(self, replay: ReplaySession):
+        self.replay = replay
+        self.offset_ms = 0.0
+        self.rtt_ms = None
+        self.latency_ms = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def now_ms(self) -> int:
+        return self.replay.now_ms()
+
+    def sleep_until(self, server_ms: float):
+        self.replay.advance(server_ms)
+
+    def next_close(self, interval_ms: int) -> int:
+        return (self.now_ms() // interval_ms + 1) * interval_ms
+
+    def sleep_until_close(self, interval_ms: int, delay_ms: float=0.0) -> int:
+        boundary = self.next_close(interval_ms)
+        self.sleep_until(boundary + delay_ms)
+        return boundary
+
+
+def enabled() -> bool:
+    return bool(os.getenv("CAPTURE_RECORD") or os.getenv("CAPTURE_REPLAY"))
+
+
+def from_env(make_session):
+    """
+    The session to use: a replay of CAPTURE_REPLAY (make_session is not
+    called, so no network is needed), make_session() recorded to
+    CAPTURE_RECORD, or just make_session().
+    """
+    if os.getenv("CAPTURE_REPLAY"):
+        speed = float(os.getenv("CAPTURE_SPEED", "1"))
+        logging.info("Replaying %s at %s", os.getenv("CAPTURE_REPLAY"), f"{speed}x" if speed else "full speed")
+        return ReplaySession(os.getenv("CAPTURE_REPLAY"), speed=speed)
+    if os.getenv("CAPTURE_RECORD"):
+        logging.info("Recording the session to %s", os.getenv("CAPTURE_RECORD"))
+        return RecordingSession(make_session(), os.getenv("CAPTURE_RECORD"))
+    return make_session()
+
+
+def summary(reader: CaptureReader) -> dict:
+    """Per method: calls, errors and latency percentiles."""
+    latencies, errors = {}, {}
+    first = last = None
+    for record in reader:
+        latencies.setdefault(record["method"], []).append(record["ms"])
+        errors[record["method"]] = errors.get(record["method"], 0) + ("error" in record)
+        first = record["start"] if first is None else first
+        last = record["start"] + record["ms"] / 1000
+    methods = {name: {"calls": len(ms), "errors": errors[name], "p50_ms": float(np.percentile(ms, 50)),
+                      "p99_ms": float(np.percentile(ms, 99))} for name, ms in latencies.items()}
+    return {"records": len(reader), "blocks": len(reader.blocks), "complete": reader.complete,
+            "seconds": (last - first) if first is not None else 0.0, "file_bytes": os.path.getsize(reader.path),
+            "raw_bytes": reader.raw_bytes, "methods": methods}
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Error: invalid arguments!!\nYou need CAPTURE_FILE [METHOD]")
+        quit()
+    reader = CaptureReader(sys.argv[1])
+    if len(sys.argv) == 3:
+        for record in reader.records(sys.argv[2]):
+            print(_json(record))
+    else:
+        s = summary(reader)
+        ratio = f", {s['raw_bytes'] / s['file_bytes']:.1f}x compressed" if s["raw_bytes"] else ""
+        print(f"{s['records']} records in {s['blocks']} blocks over {s['seconds']:.1f} s, "
+              f"{s['file_bytes']} bytes{ratio}{'' if s['complete'] else ' (no index, writer did not close)'}")
+        for name, m in sorted(s["methods"].items()):
+            print(f"  {name:<24} {m['calls']:>7} calls {m['errors']:>5} errors "
+                  f"p50 {m['p50_ms']:8.1f} ms  p99 {m['p99_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
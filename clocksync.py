@@ -0,0 +1,115 @@
+# clocksync.py
+"""
+Keep track of the offset between the local clock and Bybit server time.
+
+Each sample calls get_server_time and assumes the server read its clock
+halfway through the round trip, like NTP. The offset is taken from the
+sample with the shortest round trip in the recent window, which is the one
+least disturbed by queueing delays.
+
+install() makes pybit sign requests with server time, and sleep_until_close()
+wakes up on candle boundaries of the server clock.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from pybit import _helpers
+
+# Wake up this long before a deadline and spin for the rest
+_SPIN_S = 0.002
+
+
+class ClockSync:
+
+    def __init__(self, session, samples: int=8, window: int=64, interval: float=60.0):
+        self.session = session
+        self.samples = samples
+        self.interval = interval
+        self.history = deque(maxlen=window)  # (rtt_ms, offset_ms, local time)
+        self.offset_ms = 0.0
+        self.rtt_ms = None
+        self._original = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def sample(self):
+        """One round trip to the server. Returns (rtt_ms, offset_ms)."""
+        t0 = time.time()
+        res = self.session.get_server_time()
+        t1 = time.time()
+        if res["retCode"] != 0:
+            raise RuntimeError(f"get_server_time failed: {res}")
+        server_ms = int(res["result"]["timeNano"]) / 1e6
+        rtt = (t1 - t0) * 1000
+        offset = server_ms - (t0 + t1) * 500
+        self.history.append((rtt, offset, t1))
+        return rtt, offset
+
+    def sync(self):
+        """Take a burst of samples and update the offset from the best one."""
+        for _ in range(self.samples):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error("Clock sync sample failed: %s", e)
+        if self.history:
+            self.rtt_ms, self.offset_ms, _ = min(self.history)
+            logging.info("Clock offset to server: %.1f ms (round trip %.1f ms)", self.offset_ms, self.rtt_ms)
+
+    @property
+    def latency_ms(self):
+        """Estimated one-way latency to the server."""
+        return self.rtt_ms / 2 if self.rtt_ms is not None else None
+
+    def now_ms(self) -> int:
+        """Server time in ms."""
+        return int(time.time() * 1000 + self.offset_ms)
+
+    def install(self):
+        """Make pybit use server time for the timestamp of signed requests."""
+        if self._original is None:
+            self._original = _helpers.generate_timestamp
+            _helpers.generate_timestamp = self.now_ms
+
+    def uninstall(self):
+        if self._original is not None:
+            _helpers.generate_timestamp = self._original
+            self._original = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sync()
+
+    def start(self):
+        """Sync now, install, and keep syncing in a daemon thread."""
+        self.sync()
+        self.install()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="clock-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.uninstall()
+
+    def sleep_until(self, server_ms: float):
+        """Sleep until the server clock reaches server_ms."""
+        while True:
+            remaining = (server_ms - time.time() * 1000 - self.offset_ms) / 1000
+            if remaining <= 0:
+                return
+            if remaining > _SPIN_S:
+                time.sleep(remaining - _SPIN_S)
+
+    def next_close(self, interval_ms: int) -> int:
+        """Server time of the next candle close."""
+        return (self.now_ms() // interval_ms + 1) * interval_ms
+
+    def sleep_until_close(self, interval_ms: int, delay_ms: float=0.0) -> int:
+        """Sleep until delay_ms after the next candle close. Returns the open time of the new candle."""
+        boundary = self.next_close(interval_ms)
+        self.sleep_until(boundary + delay_ms)
+        return boundary
@@ -0,0 +1,462 @@
+# columnar.py
+"""
+Append klines, indicators, signals and orders to partitioned Parquet or
+Arrow IPC files, and read them back with memory mapping.
+
+Files are laid out as
+    ROOT/DATASET/symbol=BTCUSDT/date=2024-01/part-....parquet
+by month of the time column, or by day with partition="day".
+Rows are buffered per partition and written in row groups, so memory stays
+bounded however long a bot runs. flush() writes what is buffered as row
+groups to the open files. A Parquet or Arrow file is only readable once it
+is closed: when it reaches max_file_rows rows, on roll() and on close().
+With live=True the open files are Arrow IPC streams (.arrows) instead,
+readable up to the last flush even if the writer dies, and converted to the
+target format when they are closed.
+
+pyarrow is optional and only needed here: pip install pyarrow
+
+Usage: python columnar.py ROOT DATASET [SYMBOL]
+"""
+import atexit
+import glob
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from klines import KLINE_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+STREAM = ".arrows"  # live files of a writer with live=True
+PARTITIONS = {"month": "datetime64[M]", "day": "datetime64[D]"}
+
+# column -> type of the fixed datasets; 'symbol' and 'date' come from the partition path
+DATASETS = {
+    "klines": {"interval": "string", "open_time": "int64", "open": "float64", "high": "float64", "low": "float64",
+               "close": "float64", "volume": "float64", "turnover": "float64"},
+    "signals": {"ts": "int64", "action": "string", "price": "float64", "stop_loss": "float64",
+                "take_profit": "float64"},
+    "orders": {"ts": "int64", "side": "string", "order_type": "string", "qty": "float64", "price": "float64",
+               "reduce_only": "bool", "order_id": "string", "order_link_id": "string", "ret_code": "int64",
+               "ret_msg": "string"},
+    # indicators: interval, open_time and any float64 columns, fixed by the first batch written
+    "indicators": None,
+}
+TIME_COLUMN = {"klines": "open_time", "indicators": "open_time", "signals": "ts", "orders": "ts"}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Columnar output needs pyarrow: pip install pyarrow")
+
+
+def _schema(columns: dict):
+    return pa.schema([(name, pa.type_for_alias(kind)) for name, kind in columns.items()])
+
+
+class ColumnarWriter:
+    """
+    Streaming writer for one dataset. Rows are grouped by (symbol, date of the
+    time column, by `partition`) and written in row groups of `row_group_size` rows. At most
+    `max_buffered_rows` rows are held in memory, `max_open_files` files
+    are kept open and a file is closed once it has `max_file_rows` rows.
+    With `live` the open files are Arrow IPC streams, converted to `fmt`
+    when they are closed.
+    """
+
+    def __init__(self, root: str, dataset: str, fmt: str="parquet", partition: str="month", row_group_size: int=262_144,
+                 max_buffered_rows: int=1_000_000, max_open_files: int=32, max_file_rows: int=8_388_608,
+                 compression: str="zstd", live: bool=False):
+        _require_pyarrow()
+        if fmt not in FORMATS:
+            raise ValueError("Unsupported format")
+        if partition not in PARTITIONS:
+            raise ValueError("Unsupported partition")
+        self.unit = PARTITIONS[partition]
+        self.path = os.path.join(root, dataset)
+        self.dataset = dataset
+        self.fmt = fmt
+        self.time_column = TIME_COLUMN.get(dataset, "ts")
+        self.schema = _schema(DATASETS[dataset]) if DATASETS.get(dataset) else None
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.max_open_files = max_open_files
+        self.max_file_rows = max_file_rows
+        self.compression = compression
+        self.live = live
+        self.buffers = {}  # (symbol, date) -> [list of column dicts, rows]
+        self.buffered = 0
+        self.files = OrderedDict()  # (symbol, date) -> open writer, least recently used first
+        self.file_rows = {}  # (symbol, date) -> rows in the open file
+        self.file_paths = {}  # (symbol, date) -> path of the open file
+        self.parts = 0
+        self.rows_written = 0
+
+    def write_batch(self, symbol: str, columns: dict):
+        """Append rows of one symbol given as a dict of equal length arrays (scalars are repeated)."""
+        t = np.asarray(columns[self.time_column], dtype=np.int64)
+        n = len(t)
+        if n == 0:
+            return
+        columns = {name: np.full(n, value) if np.ndim(value) == 0 else np.asarray(value)
+                   for name, value in columns.items()}
+        if self.schema is None:
+            self.schema = pa.schema([(name, pa.string() if values.dtype.kind in "OUS" else pa.from_numpy_dtype(values.dtype))
+                                     for name, values in columns.items()])
+        periods = t.astype("datetime64[ms]").astype(self.unit)
+        if periods[0] == periods[-1] and (n < 3 or np.all(periods == periods[0])):
+            self._buffer(symbol, str(periods[0]), columns, n)
+        elif np.all(periods[1:] >= periods[:-1]):
+            # in time order: the periods are consecutive slices
+            bounds = np.concatenate([[0], np.flatnonzero(periods[1:] != periods[:-1]) + 1, [n]])
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                self._buffer(symbol, str(periods[start]), {name: values[start:end] for name, values in columns.items()},
+                             int(end - start))
+        else:
+            for period in np.unique(periods):
+                mask = periods == period
+                self._buffer(symbol, str(period), {name: values[mask] for name, values in columns.items()},
+                             int(mask.sum()))
+
+    def write_row(self, symbol: str, **row):
+        self.write_batch(symbol, {name: [value] for name, value in row.items()})
+
+    def _buffer(self, symbol, period, columns, n):
+        key = (symbol, period)
+        chunks = self.buffers.setdefault(key, [[], 0])
+        chunks[0].append(columns)
+        chunks[1] += n
+        self.buffered += n
+        if chunks[1] >= self.row_group_size:
+            self._write(key, full_groups_only=True)
+        while self.buffered > self.max_buffered_rows:
+            self._write(max(self.buffers, key=lambda k: self.buffers[k][1]))
+
+    def _table(self, chunks):
+        arrays = []
+        for field in self.schema:
+            values = np.concatenate([np.asarray(c[field.name]) for c in chunks]) if len(chunks) > 1 \
+                else np.asarray(chunks[0][field.name])
+            if pa.types.is_string(field.type):
+                values = values.astype(str)
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def _open(self, key):
+        writer = self.files.get(key)
+        if writer is not None:
+            self.files.move_to_end(key)
+            return writer
+        if len(self.files) >= self.max_open_files:
+            self._close_file(next(iter(self.files)))
+        directory = os.path.join(self.path, f"symbol={key[0]}", f"date={key[1]}")
+        os.makedirs(directory, exist_ok=True)
+        self.parts += 1
+        name = f"part-{int(time.time() * 1000)}-{os.getpid()}-{self.parts}{STREAM if self.live else FORMATS[self.fmt]}"
+        path = os.path.join(directory, name)
+        if self.live:
+            # an unbuffered file, so every flushed batch is on disk
+            writer = pa.ipc.new_stream(pa.OSFile(path, "wb"), self.schema)
+        elif self.fmt == "parquet":
+            # dictionary encoding only pays off for the string columns
+            strings = [f.name for f in self.schema if pa.types.is_string(f.type)]
+            writer = pq.ParquetWriter(path, self.schema, compression=self.compression, use_dictionary=strings)
+        else:
+            writer = pa.ipc.new_file(path, self.schema)
+        self.files[key] = writer
+        self.file_rows[key] = 0
+        self.file_paths[key] = path
+        return writer
+
+    def _close_file(self, key):
+        self.files.pop(key).close()
+        del self.file_rows[key]
+        path = self.file_paths.pop(key)
+        if self.live:
+            try:
+                compact(path, self.fmt, self.row_group_size, self.compression)
+            except (OSError, pa.ArrowException) as e:
+                logging.error("Could not convert %s, it stays an Arrow stream: %s", path, e)
+
+    def _write(self, key, full_groups_only=False):
+        chunks, rows = self.buffers.pop(key)
+        table = self._table(chunks)
+        keep = rows % self.row_group_size if full_groups_only else 0
+        done = rows - keep
+        writer = self._open(key)
+        for start in range(0, done, self.row_group_size):
+            part = table.slice(start, min(self.row_group_size, done - start))
+            if self.fmt == "parquet" and not self.live:
+                writer.write_table(part, row_group_size=self.row_group_size)
+            else:
+                writer.write_table(part, max_chunksize=self.row_group_size)
+        self.buffered -= done
+        self.rows_written += done
+        self.file_rows[key] += done
+        if self.file_rows[key] >= self.max_file_rows:
+            self._close_file(key)
+        if keep:
+            rest = table.slice(done)
+            self.buffers[key] = [[{name: rest.column(name).to_numpy(zero_copy_only=False) for name in rest.column_names}],
+                                 keep]
+
+    def flush(self):
+        """Write everything buffered as row groups; the files stay open."""
+        for key in list(self.buffers):
+            self._write(key)
+
+    def roll(self):
+        """Close the open files (live streams are converted), so readers see all rows. The next rows go to new files."""
+        for key in list(self.files):
+            self._close_file(key)
+
+    def close(self):
+        """Write everything buffered and close the open files, so readers see all rows."""
+        self.flush()
+        self.roll()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _read_stream(name):
+    """The batches of an Arrow stream up to the last complete one (its writer may have died mid-write)."""
+    batches = []
+    with pa.OSFile(name) as source:
+        reader = pa.ipc.open_stream(source)
+        try:
+            for batch in reader:
+                batches.append(batch)
+        except (OSError, pa.ArrowInvalid):
+            pass  # a truncated last batch
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def compact(name: str, fmt: str="parquet", row_group_size: int=262_144, compression: str="zstd") -> str:
+    """Convert the Arrow stream file `name` to a `fmt` file next to it and remove the stream."""
+    table = _read_stream(name)
+    path = name[:-len(STREAM)] + FORMATS[fmt]
+    tmp = path + ".tmp"
+    if fmt == "parquet":
+        strings = [f.name for f in table.schema if pa.types.is_string(f.type)]
+        pq.write_table(table, tmp, row_group_size=row_group_size, compression=compression, use_dictionary=strings)
+    else:
+        with pa.ipc.new_file(tmp, table.schema) as writer:
+            writer.write_table(table, max_chunksize=row_group_size)
+    os.replace(tmp, path)
+    os.remove(name)
+    return path
+
+
+def _partitions(path):
+    """(file, symbol, date) of every data file under a dataset directory."""
+    found = []
+    for ext in list(FORMATS.values()) + [STREAM]:
+        for name in glob.glob(os.path.join(path, "symbol=*", "date=*", f"*{ext}")):
+            parts = dict(p.split("=", 1) for p in os.path.relpath(name, path).split(os.sep)[:2])
+            found.append((name, parts["symbol"], parts["date"]))
+    return sorted(found)
+
+
+def _read_file(name, columns):
+    if name.endswith(FORMATS["parquet"]):
+        return pq.read_table(name, columns=columns, memory_map=True)
+    if name.endswith(STREAM):
+        try:
+            table = _read_stream(name)
+        except (OSError, pa.ArrowInvalid):
+            return None  # created but not even the schema written yet, or converted meanwhile
+        return table.select(columns) if columns else table
+    with pa.memory_map(name) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_table(root: str, dataset: str, columns=None, symbol: str=None, start_ms: int=None, end_ms: int=None):
+    """
+    Read a dataset as a pyarrow Table sorted by its time column, or None if
+    nothing matches. Arrow files are memory mapped; partitions outside
+    symbol / start_ms / end_ms are not opened.
+    """
+    _require_pyarrow()
+    path = os.path.join(root, dataset)
+    time_column = TIME_COLUMN.get(dataset, "ts")
+    if columns is not None:
+        columns = [c for c in columns if c != "symbol"]
+        if time_column not in columns:
+            columns = columns + [time_column]
+    first_day = str(np.datetime64(start_ms, "ms").astype("datetime64[D]")) if start_ms is not None else None
+    last_day = str(np.datetime64(end_ms, "ms").astype("datetime64[D]")) if end_ms is not None else None
+    tables = []
+    for name, sym, period in _partitions(path):
+        # a period is a month '2024-01' or a day '2024-01-31'
+        if (symbol is not None and sym != symbol) or (first_day and period < first_day[:len(period)]) \
+                or (last_day and period > last_day[:len(period)]):
+            continue
+        table = _read_file(name, columns)
+        if table is None:
+            continue
+        sym_column = pa.DictionaryArray.from_arrays(pa.array(np.zeros(table.num_rows, np.int32)), pa.array([sym]))
+        tables.append(table.append_column("symbol", sym_column))
+    if not tables:
+        return None
+    table = pa.concat_tables(tables, promote_options="permissive") if len(tables) > 1 else tables[0]
+    t = table.column(time_column).to_numpy()
+    mask = None
+    if start_ms is not None:
+        mask = t >= start_ms
+    if end_ms is not None:
+        mask = (t <= end_ms) if mask is None else mask & (t <= end_ms)
+    if mask is not None and not mask.all():
+        table = table.filter(pa.array(mask))
+        t = t[mask]
+    if len(t) > 1 and np.any(t[1:] < t[:-1]):
+        table = table.take(pa.array(np.argsort(t, kind="stable")))
+    return table
+
+
+def _numpy(table) -> dict:
+    return {name: table.column(name).combine_chunks().to_numpy(zero_copy_only=False) for name in table.column_names}
+
+
+def read(root: str, dataset: str, columns=None, symbol: str=None, start_ms: int=None, end_ms: int=None) -> dict:
+    """read_table() as a dict of numpy arrays; empty if nothing matches."""
+    table = read_table(root, dataset, columns, symbol, start_ms, end_ms)
+    return _numpy(table) if table is not None else {}
+
+
+def load_klines(root: str, symbol: str=None, interval: str=None, start_ms: int=None, end_ms: int=None) -> dict:
+    """
+    Kline arrays keyed by KLINE_COLUMNS, ascending and deduplicated, for the
+    backtester. `root` may also be the klines dataset directory itself.
+    """
+    if os.path.basename(os.path.normpath(root)) == "klines":
+        root = os.path.dirname(os.path.normpath(root))
+    table = read_table(root, "klines", None, symbol, start_ms, end_ms)
+    if table is None:
+        return {name: np.empty(0, dtype=np.int64 if name == "open_time" else np.float64) for name in KLINE_COLUMNS}
+    if interval is not None:
+        table = table.filter(pc.equal(table.column("interval"), str(interval)))
+    symbols = pc.unique(table.column("symbol").combine_chunks().dictionary_decode()).to_pylist()
+    if len(symbols) > 1:
+        raise ValueError(f"More than one symbol in {root}: {', '.join(symbols)}")
+    if len(pc.unique(table.column("interval"))) > 1:
+        raise ValueError(f"More than one interval in {root}, pass interval")
+    data = _numpy(table.select(list(KLINE_COLUMNS)))
+    t = data["open_time"]
+    # of candles written more than once, the last one wins
+    last = np.append(t[1:] != t[:-1], True)
+    return data if last.all() else {name: values[last] for name, values in data.items()}
+
+
+def write_klines(root: str, symbol: str, interval: str, data: dict, fmt: str="parquet"):
+    """Write a whole kline history, e.g. from history.fetch_history()."""
+    with ColumnarWriter(root, "klines", fmt) as writer:
+        writer.write_batch(symbol, dict({name: data[name] for name in KLINE_COLUMNS}, interval=str(interval)))
+
+
+class Recorder:
+    """
+    What a bot records while it runs: closed candles, indicator values,
+    signals and orders. Buffered rows are written every `flush_interval`
+    seconds to live Arrow streams, readable at once and after a crash, which
+    are converted to `fmt` files every `roll_interval` seconds and at exit.
+    Safe to call from several threads (orders are recorded from the order
+    manager's threads).
+    """
+
+    def __init__(self, root: str, fmt: str="parquet", flush_interval: float=300.0, roll_interval: float=86_400.0):
+        self.writers = {name: ColumnarWriter(root, name, fmt, live=True) for name in DATASETS}
+        self.flush_interval = flush_interval
+        self.roll_interval = roll_interval
+        self.flushed = self.rolled = time.monotonic()
+        self.last_open_time = {}
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    def _tick(self):
+        now = time.monotonic()
+        if now - self.rolled >= self.roll_interval:
+            self.roll()
+        elif now - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def klines(self, symbol: str, interval: str, data: dict, indicators: dict=None):
+        """Record candles (and their indicator values) newer than the last recorded one of symbol and interval."""
+        t = np.asarray(data["open_time"], dtype=np.int64)
+        with self._lock:
+            new = t > self.last_open_time.get((symbol, interval), -1)
+            if not new.any():
+                return
+            self.last_open_time[(symbol, interval)] = int(t[new][-1])
+            candles = {name: np.asarray(data[name])[new] for name in KLINE_COLUMNS}
+            self.writers["klines"].write_batch(symbol, dict(candles, interval=str(interval)))
+            if indicators:
+                columns = {name: np.asarray(values, dtype=np.float64)[new] for name, values in indicators.items()}
+                self.writers["indicators"].write_batch(symbol, dict(columns, interval=str(interval), open_time=t[new]))
+            self._tick()
+
+    def signal(self, symbol: str, ts: int, action: str, price: float, stop_loss=None, take_profit=None):
+        with self._lock:
+            self.writers["signals"].write_row(symbol, ts=int(ts), action=action, price=float(price),
+                                              stop_loss=np.nan if stop_loss is None else float(stop_loss),
+                                              take_profit=np.nan if take_profit is None else float(take_profit))
+            self._tick()
+
+    def order(self, symbol: str, side: str, order_type: str, qty, price=None, reduce_only: bool=False, response=None):
+        """Record an order and the API response to it."""
+        response = response or {}
+        result = response.get("result") or {}
+        with self._lock:
+            self.writers["orders"].write_row(symbol, ts=int(time.time() * 1000), side=side, order_type=order_type,
+                                             qty=float(qty), price=np.nan if price is None else float(price),
+                                             reduce_only=bool(reduce_only), order_id=result.get("orderId", ""),
+                                             order_link_id=result.get("orderLinkId", ""),
+                                             ret_code=int(response.get("retCode", -1)),
+                                             ret_msg=response.get("retMsg", ""))
+            self._tick()
+
+    def flush(self):
+        with self._lock:
+            for writer in self.writers.values():
+                writer.flush()
+            self.flushed = time.monotonic()
+
+    def roll(self):
+        """Write everything buffered and convert the live files to `fmt` files."""
+        with self._lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.flushed = self.rolled = time.monotonic()
+
+    close = roll
+
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print("Error: invalid arguments!!\nYou need ROOT DATASET [SYMBOL]")
+        quit()
+    start = time.perf_counter()
+    data = read(sys.argv[1], sys.argv[2], symbol=sys.argv[3] if len(sys.argv) == 4 else None)
+    elapsed = time.perf_counter() - start
+    rows = len(next(iter(data.values()))) if data else 0
+    print(f"{rows} rows, columns: {', '.join(data)} ({elapsed:.3f}s)")
+
+
+if __name__ == '__main__':
+    main()
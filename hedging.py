@@ -0,0 +1,212 @@
+# hedging.py
+"""
+Request hedging and safe order retries around a pybit HTTP session.
+
+Reads (get_kline, get_positions, ...) are sent again when the first request
+has taken longer than the recent p95 latency of that endpoint, and the first
+response wins. Orders get a client orderLinkId, so an order that timed out
+can be sent again: if the first one did reach the exchange, the retry is
+rejected as a duplicate and the existing order is returned instead.
+
+Per endpoint it keeps how often hedging fired and the p99 latency with and
+without hedging (the latency the first request alone would have had).
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+# Idempotent calls that may be sent twice. get_server_time is not hedged: ClockSync times the call itself,
+# and the answer of a hedge sent later would bias its offset by the hedge delay
+READ_METHODS = {
+    "get_kline", "get_mark_price_kline", "get_index_price_kline", "get_tickers", "get_orderbook",
+    "get_positions", "get_wallet_balance", "get_open_orders", "get_order_history", "get_executions",
+    "get_instruments_info", "get_fee_rates",
+}
+ORDER_METHODS = {"place_order"}
+
+# Bybit retCode for an orderLinkId that was already used
+DUPLICATE_ORDER_LINK_ID = 110072
+
+
+class EndpointStats:
+    """Latency samples of one endpoint."""
+
+    def __init__(self, window: int=1000):
+        self.primary = deque(maxlen=window)  # latency of the first request, even when it lost
+        self.effective = deque(maxlen=window)  # latency the caller saw
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def percentile(self, q, samples=None):
+        samples = self.primary if samples is None else samples
+        with self.lock:
+            values = list(samples)
+        return float(np.percentile(values, q)) if values else None
+
+
+class HedgedSession:
+    """
+    Wraps a pybit HTTP session. Attributes other than the hedged methods are
+    passed through, so it can be used wherever the session is.
+    """
+
+    def __init__(self, session, hedge_percentile: float=95, min_delay_ms: float=50, initial_delay_ms: float=1000,
+                 min_samples: int=20, order_timeout: float=5.0, order_attempts: int=3, max_workers: int=16):
+        self.session = session
+        self.hedge_percentile = hedge_percentile
+        self.min_delay_ms = min_delay_ms
+        self.initial_delay_ms = initial_delay_ms
+        self.min_samples = min_samples
+        self.order_timeout = order_timeout
+        self.order_attempts = order_attempts
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.stats = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self.session, name)
+        if name in READ_METHODS:
+            return lambda **kwargs: self._hedged(name, attr, kwargs)
+        if name in ORDER_METHODS:
+            return lambda **kwargs: self._order(name, attr, kwargs)
+        return attr
+
+    def _stats(self, name) -> EndpointStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats.setdefault(name, EndpointStats())
+        return stats
+
+    def hedge_delay(self, name) -> float:
+        """Seconds to wait for the first request before sending the second."""
+        stats = self._stats(name)
+        if len(stats.primary) < self.min_samples:
+            return self.initial_delay_ms / 1000
+        return max(stats.percentile(self.hedge_percentile), self.min_delay_ms) / 1000
+
+    def _submit(self, stats, fn, kwargs, primary):
+        start = time.perf_counter()
+        future = self.executor.submit(fn, **kwargs)
+        if primary:
+            def done(f):
+                with stats.lock:
+                    stats.primary.append((time.perf_counter() - start) * 1000)
+            future.add_done_callback(done)
+        return future
+
+    def _first_result(self, futures, timeout=None):
+        """Result of the first future that succeeds; raises the last error if all fail."""
+        pending = set(futures)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("No response in time")
+            for f in done:
+                if f.exception() is None:
+                    return f, f.result()
+                error = f.exception()
+        raise error
+
+    def _hedged(self, name, fn, kwargs):
+        stats = self._stats(name)
+        start = time.perf_counter()
+        first = self._submit(stats, fn, kwargs, primary=True)
+        futures = [first]
+        done, _ = wait(futures, timeout=self.hedge_delay(name))
+        if not done:
+            futures.append(self._submit(stats, fn, kwargs, primary=False))
+        try:
+            winner, result = self._first_result(futures)
+        finally:
+            with stats.lock:
+                stats.calls += 1
+                stats.hedged += len(futures) > 1
+                stats.effective.append((time.perf_counter() - start) * 1000)
+        if winner is not first:
+            with stats.lock:
+                stats.hedge_wins += 1
+        return result
+
+    def _order(self, name, fn, kwargs):
+        """Send an order with an orderLinkId, sending it again if it times out or fails on the network."""
+        kwargs = dict(kwargs)
+        link_id = kwargs.get("order_link_id") or kwargs.setdefault("orderLinkId", uuid.uuid4().hex)
+        stats = self._stats(name)
+        start = time.perf_counter()
+        futures = []
+        try:
+            for attempt in range(self.order_attempts):
+                futures.append(self._submit(stats, fn, kwargs, primary=attempt == 0))
+                try:
+                    winner, result = self._first_result(futures, timeout=self.order_timeout)
+                    return result
+                except TimeoutError:
+                    logging.warning("%s %s timed out, sending again", name, link_id)
+                except Exception as e:
+                    if getattr(e, "status_code", None) == DUPLICATE_ORDER_LINK_ID:
+                        # an earlier attempt reached the exchange
+                        return self._existing_order(kwargs)
+                    if attempt == self.order_attempts - 1 or not _network_error(e):
+                        raise
+                    logging.warning("%s %s failed (%s), sending again", name, link_id, e)
+                    futures = [f for f in futures if not f.done()]
+            winner, result = self._first_result(futures, timeout=self.order_timeout)
+            return result
+        finally:
+            with stats.lock:
+                stats.calls += 1
+                stats.hedged += len(futures) > 1
+                stats.effective.append((time.perf_counter() - start) * 1000)
+
+    def _existing_order(self, kwargs):
+        link_id = kwargs.get("order_link_id") or kwargs["orderLinkId"]
+        query = {"category": kwargs.get("category", "linear"), "symbol": kwargs.get("symbol"), "orderLinkId": link_id}
+        res = self.session.get_open_orders(**query)
+        orders = res["result"]["list"]
+        if not orders:
+            # a market / IOC order that already filled is only in the history
+            res = self.session.get_order_history(**query)
+            orders = res["result"]["list"]
+        if not orders:
+            raise RuntimeError(f"Order {link_id} reported as duplicate but not found")
+        order = orders[0]
+        return dict(res, result={"orderId": order["orderId"], "orderLinkId": order["orderLinkId"]})
+
+    def report(self) -> dict:
+        """Per endpoint: calls, how often hedging fired, and p99 latency without and with hedging (ms)."""
+        report = {}
+        for name, stats in self.stats.items():
+            p99_primary = stats.percentile(99)
+            p99 = stats.percentile(99, stats.effective)
+            report[name] = {
+                "calls": stats.calls,
+                "hedged": stats.hedged,
+                "hedge_rate": stats.hedged / stats.calls if stats.calls else 0.0,
+                "hedge_wins": stats.hedge_wins,
+                "p99_unhedged_ms": p99_primary,
+                "p99_ms": p99,
+                "p99_saved_ms": p99_primary - p99 if p99 is not None and p99_primary is not None else None,
+            }
+        return report
+
+    def log_report(self):
+        for name, r in sorted(self.report().items()):
+            logging.info("%s: %d calls, hedged %.1f%%, p99 %s ms (unhedged %s ms)", name, r["calls"],
+                         r["hedge_rate"] * 100, _ms(r["p99_ms"]), _ms(r["p99_unhedged_ms"]))
+
+
+def _network_error(e) -> bool:
+    import requests
+    from pybit.exceptions import FailedRequestError
+    return isinstance(e, (FailedRequestError, requests.exceptions.RequestException, TimeoutError, OSError))
+
+
+def _ms(value):
+    return f"{value:.1f}" if value is not None else "-"
@@ -0,0 +1,64 @@
+# history.py
+"""
+Download and cache historical klines as numpy arrays.
+
+Histories are kept as .npz files, or as columnar (Parquet / Arrow) kline
+datasets written by columnar.py, which load faster for long histories.
+"""
+import logging
+import os
+
+import numpy as np
+
+from klines import KLINE_COLUMNS, parse_kline_rows
+
+# Bybit returns at most this many klines per request
+MAX_LIMIT = 1000
+
+
+def klines_from_rows(rows) -> dict:
+    """Convert get_kline rows (lists of strings, any order) into ascending arrays."""
+    return parse_kline_rows(rows)
+
+
+def fetch_history(session, symbol, interval, start_ms, end_ms, category="linear") -> dict:
+    """
+    Fetch all klines between start_ms and end_ms (inclusive), paging backwards
+    from end_ms. Returns a dict of arrays in ascending time order.
+    """
+    rows = []
+    end = end_ms
+    while end >= start_ms:
+        response = session.get_kline(category=category, symbol=symbol, interval=interval,
+                                     start=start_ms, end=end, limit=MAX_LIMIT)
+        if response['retCode'] != 0:
+            logging.error("Error fetching klines: %s", response)
+            break
+        page = response['result']['list']
+        if not page:
+            break
+        rows.extend(page)
+        oldest = min(int(r[0]) for r in page)
+        if len(page) < MAX_LIMIT:
+            break
+        end = oldest - 1
+    data = klines_from_rows(rows)
+    _, unique = np.unique(data["open_time"], return_index=True)
+    return {name: values[unique] for name, values in data.items()}
+
+
+def save_history(path, data):
+    """Save kline arrays to an .npz file."""
+    np.savez(path, **data)
+
+
+def load_history(path, symbol=None, interval=None) -> dict:
+    """
+    Load kline arrays saved with save_history(), or from a columnar klines
+    dataset directory (see columnar.py) for the given symbol and interval.
+    """
+    if os.path.isdir(path):
+        import columnar
+        return columnar.load_klines(path, symbol, interval)
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
@@ -0,0 +1,182 @@
+# indicators.py
+"""
+Vectorized versions of the indicators used by the bots.
+Every function works on numpy arrays along axis 0, so a 1-D close series and
+a (time x symbol) matrix are handled the same way. Values that cannot be
+computed yet are NaN (the list based versions in main-bot-1.py use None).
+"""
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MA_TYPES = ("SMA", "EMA", "SMMA (RMA)", "WMA", "VWMA")
+
+# Max number of floats materialized at once by the rolling window helpers
+_CHUNK = 1 << 22
+
+
+def _empty(values):
+    return np.full(values.shape, np.nan, dtype=np.float64)
+
+
+def ewm(values, alpha, init=None):
+    """
+    Exponential smoothing y[t] = alpha * x[t] + (1 - alpha) * y[t-1].
+    y[0] is x[0] unless the previous value `init` is given.
+    The recursion is evaluated block by block in closed form, so there is no
+    Python loop per element.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    out = np.empty_like(x)
+    if len(x) == 0:
+        return out
+    a = 1.0 - alpha
+    if a <= 0.0:
+        out[:] = x
+        return out
+    # a ** -block must stay well inside the float range
+    block = max(1, min(len(x), int(30 * math.log(10) / -math.log(a)))) if a < 1.0 else len(x)
+    powers = a ** np.arange(block + 1, dtype=np.float64)
+    inv_powers = 1.0 / powers
+    shape = (-1,) + (1,) * (x.ndim - 1)
+    if init is None:
+        prev = x[0].copy() if x.ndim > 1 else x[0]
+        out[0] = x[0]
+        start = 1
+    else:
+        prev = init
+        start = 0
+    while start < len(x):
+        stop = min(start + block, len(x))
+        n = stop - start
+        p = powers[1:n + 1].reshape(shape)
+        acc = np.cumsum(x[start:stop] * inv_powers[1:n + 1].reshape(shape), axis=0)
+        out[start:stop] = p * (prev + alpha * acc)
+        prev = out[stop - 1]
+        start = stop
+    return out
+
+
+def _rolling_sum(x, length):
+    out = _empty(x)
+    # Cumulative sums are restarted every block to keep rounding error bounded
+    block = max(length, _CHUNK // max(1, x[0].size))
+    zero = np.zeros((1,) + x.shape[1:])
+    for s in range(0, len(x) - length + 1, block):
+        c = np.concatenate([zero, np.cumsum(x[s:s + block + length - 1], axis=0)])
+        out[s + length - 1:s + block + length - 1] = c[length:] - c[:-length]
+    return out
+
+
+def rolling_sum(values, length):
+    """Rolling sum over `length` rows; NaN if the window holds a NaN."""
+    x = np.asarray(values, dtype=np.float64)
+    if length > len(x):
+        return _empty(x)
+    missing = np.isnan(x)
+    if not missing.any():
+        return _rolling_sum(x, length)
+    out = _rolling_sum(np.where(missing, 0.0, x), length)
+    out[_rolling_sum(missing.astype(np.float64), length) > 0] = np.nan
+    return out
+
+
+def rolling_std(values, length):
+    """Rolling sample standard deviation (n-1 in denominator), like statistics.stdev."""
+    x = np.asarray(values, dtype=np.float64)
+    out = _empty(x)
+    if length > len(x):
+        return out
+    if length <= 1:
+        out[length - 1:] = 0.0
+        return out
+    windows = sliding_window_view(x, length, axis=0)
+    step = max(1, _CHUNK // (length * max(1, x[0].size)))
+    for s in range(0, len(windows), step):
+        out[length - 1 + s:length - 1 + s + step] = windows[s:s + step].std(axis=-1, ddof=1)
+    return out
+
+
+def sma(values, length):
+    return rolling_sum(values, length) / length
+
+
+def ema(values, length):
+    """EMA seeded with the first value, as in main-bot-1.py."""
+    return ewm(values, 2.0 / (length + 1))
+
+
+def rma(values, length):
+    """Wilder's moving average: SMA of the first `length` values, then alpha = 1/length."""
+    x = np.asarray(values, dtype=np.float64)
+    out = _empty(x)
+    if length > len(x):
+        return out
+    out[length - 1] = x[:length].mean(axis=0)
+    out[length:] = ewm(x[length:], 1.0 / length, init=out[length - 1])
+    return out
+
+
+def wma(values, length):
+    """Linearly weighted moving average, newest value has weight `length`."""
+    x = np.asarray(values, dtype=np.float64)
+    out = _empty(x)
+    if length > len(x):
+        return out
+    weights = np.arange(1, length + 1, dtype=np.float64)
+    windows = sliding_window_view(x, length, axis=0)
+    step = max(1, _CHUNK // (length * max(1, x[0].size)))
+    for s in range(0, len(windows), step):
+        out[length - 1 + s:length - 1 + s + step] = windows[s:s + step] @ weights / weights.sum()
+    return out
+
+
+def vwma(values, volumes, length):
+    """Volume weighted moving average; NaN where the window volume is zero."""
+    x = np.asarray(values, dtype=np.float64)
+    v = np.asarray(volumes, dtype=np.float64)
+    pv = rolling_sum(x * v, length)
+    vol = rolling_sum(v, length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(vol != 0, pv / vol, np.nan)
+
+
+def moving_average(values, length, ma_type="SMA", volumes=None):
+    """Same interface and results as moving_average() in main-bot-1.py."""
+    if ma_type == "SMA":
+        return sma(values, length)
+    elif ma_type == "EMA":
+        return ema(values, length)
+    elif ma_type == "SMMA (RMA)":
+        return rma(values, length)
+    elif ma_type == "WMA":
+        return wma(values, length)
+    elif ma_type == "VWMA":
+        if volumes is None:
+            raise ValueError("Volumes are required for VWMA")
+        return vwma(values, volumes, length)
+    raise ValueError("Unsupported moving average type")
+
+
+def bollinger_bands(close, length=20, ma_type="SMA", mult=2.0, volume=None):
+    """
+    Bollinger Bands on closing prices.
+    Returns four arrays: basis, upper, lower, and dev.
+    """
+    basis = moving_average(close, length, ma_type, volume if ma_type == "VWMA" else None)
+    dev = rolling_std(close, length) * mult
+    return basis, basis + dev, basis - dev, dev
+
+
+def rsi(close, length=14):
+    """RSI with Wilder smoothing, matching ta.momentum.RSIIndicator."""
+    x = np.asarray(close, dtype=np.float64)
+    diff = np.zeros_like(x)
+    diff[1:] = x[1:] - x[:-1]
+    up = ewm(np.where(diff > 0, diff, 0.0), 1.0 / length)
+    down = ewm(np.where(diff < 0, -diff, 0.0), 1.0 / length)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(down == 0, 100.0, 100.0 - 100.0 / (1.0 + up / down))
+    out[:length - 1] = np.nan
+    return out
@@ -0,0 +1,202 @@
+# instruments.py
+"""
+Instrument specs (tick size, qty step, min qty, min notional) for all linear
+symbols, with exact rounding of prices and quantities to them.
+
+Specs are loaded in bulk with get_instruments_info, kept in memory with a TTL
+and saved to disk, so a restart can use them without waiting for the exchange.
+Stale specs keep being served while a background thread refreshes them, so
+only the first load of a symbol waits for the exchange.
+
+Steps are kept as integers with a number of decimals ("0.005" -> 5, 3), and
+values are rounded in integer multiples of the step, then formatted with
+exactly that many decimals. No Decimal is needed and the strings sent to the
+exchange are always on the grid.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+DEFAULT_PATH = "instruments.json"
+
+# Tolerance, in steps, for float noise such as 0.3 / 0.1 = 2.9999999999999996
+_EPS = 1e-9
+
+
+def _step(text: str):
+    """'0.005' -> (5, 3); '10' -> (10, 0)."""
+    text = text.strip()
+    if "." in text:
+        whole, frac = text.split(".")
+        frac = frac.rstrip("0")
+        return int(whole + frac) if whole + frac else 0, len(frac)
+    return int(text), 0
+
+
+def _spec(info: dict) -> dict:
+    price_filter = info["priceFilter"]
+    lot = info["lotSizeFilter"]
+    tick, tick_dec = _step(price_filter["tickSize"])
+    qty_step, qty_dec = _step(lot["qtyStep"])
+    return {
+        "symbol": info["symbol"],
+        "tick": tick,
+        "tick_decimals": tick_dec,
+        "qty_step": qty_step,
+        "qty_decimals": qty_dec,
+        "min_qty": float(lot["minOrderQty"]),
+        "max_qty": float(lot["maxOrderQty"]),
+        "max_market_qty": float(lot.get("maxMktOrderQty") or lot["maxOrderQty"]),
+        "min_notional": float(lot.get("minNotionalValue") or 0),
+        "min_price": float(price_filter["minPrice"]),
+        "max_price": float(price_filter["maxPrice"]),
+    }
+
+
+def _round_steps(value: float, step: int, decimals: int, mode: str) -> int:
+    """Number of whole steps in value, rounded 'down', 'up' or to the 'nearest' step."""
+    steps = value * 10 ** decimals / step
+    if mode == "down":
+        return math.floor(steps + _EPS)
+    elif mode == "up":
+        return math.ceil(steps - _EPS)
+    return math.floor(steps + 0.5)
+
+
+def _format(steps: int, step: int, decimals: int) -> str:
+    units = steps * step
+    if decimals == 0:
+        return str(units)
+    sign = "-" if units < 0 else ""
+    digits = str(abs(units)).rjust(decimals + 1, "0")
+    return f"{sign}{digits[:-decimals]}.{digits[-decimals:]}"
+
+
+def round_price(spec: dict, price: float, mode: str="nearest") -> str:
+    """Price on the tick grid as a string. mode: 'nearest', 'down' or 'up'."""
+    return _format(_round_steps(float(price), spec["tick"], spec["tick_decimals"], mode),
+                   spec["tick"], spec["tick_decimals"])
+
+
+def round_qty(spec: dict, qty: float, mode: str="down") -> str:
+    """Quantity on the qty step grid as a string; rounds down by default so it never exceeds qty."""
+    return _format(_round_steps(float(qty), spec["qty_step"], spec["qty_decimals"], mode),
+                   spec["qty_step"], spec["qty_decimals"])
+
+
+def check_order(spec: dict, qty, price, market: bool=False):
+    """
+    Check a rounded order against the instrument limits.
+    Returns None if it is valid, otherwise a string with the reason.
+    """
+    qty = float(qty)
+    price = float(price)
+    max_qty = spec["max_market_qty"] if market else spec["max_qty"]
+    if qty < spec["min_qty"]:
+        return f"qty {qty} below minimum {spec['min_qty']}"
+    if qty > max_qty:
+        return f"qty {qty} above maximum {max_qty}"
+    if not market and not spec["min_price"] <= price <= spec["max_price"]:
+        return f"price {price} outside {spec['min_price']} - {spec['max_price']}"
+    if qty * price < spec["min_notional"]:
+        return f"notional {qty * price:.4f} below minimum {spec['min_notional']}"
+    return None
+
+
+class InstrumentCache:
+    """Specs of all linear instruments, refreshed from the exchange when older than `ttl` seconds."""
+
+    def __init__(self, session, path: str=DEFAULT_PATH, ttl: float=3600.0, category: str="linear"):
+        self.session = session
+        self.path = path
+        self.ttl = ttl
+        self.category = category
+        self.specs = {}
+        self.updated = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._load_file()
+
+    def _load_file(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            if saved.get("category") == self.category:
+                self.specs = saved["instruments"]
+                self.updated = saved["updated"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Could not read instrument cache %s: %s", self.path, e)
+
+    def _save_file(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"category": self.category, "updated": self.updated, "instruments": self.specs}, f)
+        os.replace(tmp, self.path)
+
+    def refresh(self):
+        """Load the specs of every instrument in the category, following the page cursor."""
+        specs = {}
+        cursor = None
+        while True:
+            res = self.session.get_instruments_info(category=self.category, limit=1000, cursor=cursor)
+            if res["retCode"] != 0:
+                raise RuntimeError(f"get_instruments_info failed: {res}")
+            for info in res["result"]["list"]:
+                specs[info["symbol"]] = _spec(info)
+            cursor = res["result"].get("nextPageCursor")
+            if not cursor:
+                break
+        with self._lock:
+            self.specs = specs
+            self.updated = time.time()
+        self._save_file()
+        logging.info("Loaded %d %s instruments", len(specs), self.category)
+
+    def stale(self) -> bool:
+        return time.time() - self.updated > self.ttl
+
+    def _run(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logging.error("Instrument refresh failed, using cached specs: %s", e)
+        finally:
+            self._thread = None
+
+    def refresh_async(self):
+        """Refresh in a background thread, unless one is already running."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            thread = self._thread = threading.Thread(target=self._run, name="instruments", daemon=True)
+        thread.start()
+
+    def get(self, symbol: str) -> dict:
+        """
+        Spec of a symbol. An unknown symbol is loaded first; a stale cache is
+        refreshed in the background while the cached spec is returned.
+        """
+        spec = self.specs.get(symbol)
+        if spec is None:
+            self.refresh()
+            return self.specs[symbol]
+        if self.stale():
+            self.refresh_async()
+        return spec
+
+    def prepare_order(self, symbol: str, qty, price, market: bool=False):
+        """
+        Round qty and price of an order to the instrument grid.
+        Returns (qty, price, reason) with qty and price as strings; reason is None if the order is valid.
+        """
+        spec = self.get(symbol)
+        price = round_price(spec, price)
+        qty = round_qty(spec, qty)
+        return qty, price, check_order(spec, qty, price, market)
@@ -0,0 +1,307 @@
+# intrabar.py
+"""
+Intrabar signal evaluation on live price updates.
+
+The bots decide once per candle, on the last two candles. Here the SMA/RSI
+(main-bot.py) and Bollinger Band (main-bot-1.py) rules are evaluated on every
+update of the forming candle from the kline websocket stream. Window sums of
+the closed candles are rebuilt once per candle, so each update costs O(1).
+
+Intrabar signals must hold for a number of updates and a minimum time before
+they fire (Debouncer), and each signal fires at most once per candle.
+Bar-close decisions are evaluated as well and both are recorded, so the two
+can be compared.
+
+Usage: python intrabar.py SYMBOL TIMEFRAME [sma_rsi|bollinger]
+"""
+import csv
+import logging
+import math
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from dotenv import load_dotenv
+
+import indicators
+from klines import parse_kline_response
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+class SmaRsiState:
+    """SMA crossover with RSI filter of main-bot.py, for the forming candle."""
+
+    def __init__(self, fast_length=9, slow_length=21, rsi_length=14, rsi_overbought=70, rsi_oversold=30):
+        self.fast_length = fast_length
+        self.slow_length = slow_length
+        self.rsi_overbought = rsi_overbought
+        self.rsi_oversold = rsi_oversold
+        self.alpha = 1.0 / rsi_length
+        self.closes = deque(maxlen=slow_length)
+        self.avg_up = 0.0
+        self.avg_down = 0.0
+        self.position = 0  # 0: no position, 1: long, -1: short
+        self.prev = None  # (fast_sma, slow_sma) at the last closed candle
+
+    def seed(self, closes):
+        """Initialise from closed candles, oldest first."""
+        closes = np.asarray(closes, dtype=np.float64)
+        diff = np.diff(closes, prepend=closes[:1])
+        self.avg_up = float(indicators.ewm(np.where(diff > 0, diff, 0.0), self.alpha)[-1])
+        self.avg_down = float(indicators.ewm(np.where(diff < 0, -diff, 0.0), self.alpha)[-1])
+        self.closes.clear()
+        self.closes.extend(closes[-self.slow_length:].tolist())
+        self._roll()
+
+    def _roll(self):
+        values = list(self.closes)
+        if len(values) < self.slow_length:
+            self.prev = None
+            return
+        self.prev = (sum(values[-self.fast_length:]) / self.fast_length, sum(values) / self.slow_length)
+        # sums of the closed candles that stay in the windows of the forming one
+        self.fast_base = sum(values[len(values) - self.fast_length + 1:])
+        self.slow_base = sum(values[1:])
+
+    def evaluate(self, price):
+        """
+        Signal if the forming candle closed at `price`: 'long', 'short' or
+        None, also None when it would only hold the position that is open.
+        """
+        if self.prev is None:
+            return None
+        fast = (self.fast_base + price) / self.fast_length
+        slow = (self.slow_base + price) / self.slow_length
+        diff = price - self.closes[-1]
+        up = self.alpha * max(diff, 0.0) + (1 - self.alpha) * self.avg_up
+        down = self.alpha * max(-diff, 0.0) + (1 - self.alpha) * self.avg_down
+        rsi = 100.0 if down == 0 else 100.0 - 100.0 / (1.0 + up / down)
+        prev_fast, prev_slow = self.prev
+        if self.position != 1 and prev_fast < prev_slow and fast > slow and rsi > self.rsi_oversold:
+            return 'long'
+        if self.position != -1 and prev_fast > prev_slow and fast < slow and rsi < self.rsi_overbought:
+            return 'short'
+        return None
+
+    def apply(self, signal):
+        """Update the position like main-bot.py: a signal against the position closes it, otherwise opens one."""
+        if signal == 'long':
+            self.position = min(self.position + 1, 1)
+        elif signal == 'short':
+            self.position = max(self.position - 1, -1)
+
+    def close_bar(self, close):
+        """Roll the state forward with a closed candle."""
+        if self.closes:
+            diff = close - self.closes[-1]
+            self.avg_up = self.alpha * max(diff, 0.0) + (1 - self.alpha) * self.avg_up
+            self.avg_down = self.alpha * max(-diff, 0.0) + (1 - self.alpha) * self.avg_down
+        self.closes.append(close)
+        self._roll()
+
+
+class BollingerState:
+    """Bollinger Band entries and exits of main-bot-1.py, for the forming candle (SMA or EMA basis)."""
+
+    def __init__(self, length=20, ma_type="SMA", mult=2.0):
+        if ma_type not in ("SMA", "EMA"):
+            raise ValueError("Intrabar Bollinger Bands support SMA and EMA basis only")
+        self.length = length
+        self.ma_type = ma_type
+        self.mult = mult
+        self.alpha = 2.0 / (length + 1)
+        self.closes = deque(maxlen=length)
+        self.ema = None
+        self.position = 0  # 0: no position, 1: long, -1: short
+        self.prev = None  # (close, basis, upper, lower) at the last closed candle
+
+    def seed(self, closes):
+        closes = np.asarray(closes, dtype=np.float64)
+        self.ema = float(indicators.ema(closes, self.length)[-1])
+        self.closes.clear()
+        self.closes.extend(closes[-self.length:].tolist())
+        self._roll()
+
+    def _roll(self):
+        values = list(self.closes)
+        if len(values) < self.length or self.length < 2:
+            self.prev = None
+            return
+        mean = sum(values) / self.length
+        dev = math.sqrt(sum((v - mean) ** 2 for v in values) / (self.length - 1)) * self.mult
+        basis = mean if self.ma_type == "SMA" else self.ema
+        self.prev = (values[-1], basis, basis + dev, basis - dev)
+        # deviations of the closed candles that stay in the window, around the last close
+        self.ref = values[-1]
+        rest = [v - self.ref for v in values[1:]]
+        self.s1 = sum(rest)
+        self.s2 = sum(d * d for d in rest)
+
+    def bands(self, price):
+        """(basis, upper, lower, dev) if the forming candle closed at `price`."""
+        d = price - self.ref
+        s1 = self.s1 + d
+        var = (self.s2 + d * d - s1 * s1 / self.length) / (self.length - 1)
+        dev = math.sqrt(max(var, 0.0)) * self.mult
+        if self.ma_type == "SMA":
+            basis = self.ref + s1 / self.length
+        else:
+            basis = self.alpha * price + (1 - self.alpha) * self.ema
+        return basis, basis + dev, basis - dev, dev
+
+    def evaluate(self, price):
+        """Action if the forming candle closed at `price`, e.g. 'Long Entry', or None."""
+        if self.prev is None:
+            return None
+        prev_close, prev_basis, prev_upper, prev_lower = self.prev
+        basis, upper, lower, dev = self.bands(price)
+        if self.position == 0 and prev_close <= prev_lower and price > lower:
+            return "Long Entry"
+        elif self.position == 1 and prev_close >= prev_basis and price < basis:
+            return "Long Exit"
+        elif self.position == 0 and prev_close >= prev_upper and price < upper:
+            return "Short Entry"
+        elif self.position == -1 and prev_close <= prev_basis and price > basis:
+            return "Short Exit"
+        return None
+
+    def apply(self, action):
+        """Update the position after an action was taken."""
+        self.position = {"Long Entry": 1, "Short Entry": -1}.get(action, 0)
+
+    def close_bar(self, close):
+        self.ema = close if self.ema is None else self.alpha * close + (1 - self.alpha) * self.ema
+        self.closes.append(close)
+        self._roll()
+
+
+class Debouncer:
+    """
+    Lets an intrabar signal through only after it was seen on `confirm_updates`
+    consecutive updates spanning at least `confirm_ms`, and only once per candle.
+    """
+
+    def __init__(self, confirm_updates=3, confirm_ms=0):
+        self.confirm_updates = confirm_updates
+        self.confirm_ms = confirm_ms
+        self.reset()
+
+    def reset(self):
+        """Call at the start of every candle."""
+        self.pending = None
+        self.count = 0
+        self.since = 0
+        self.fired = set()
+
+    def update(self, signal, now_ms):
+        if signal != self.pending:
+            self.pending = signal
+            self.count = 0
+            self.since = now_ms
+        if signal is None or signal in self.fired:
+            return None
+        self.count += 1
+        if self.count >= self.confirm_updates and now_ms - self.since >= self.confirm_ms:
+            self.fired.add(signal)
+            return signal
+        return None
+
+
+class IntrabarRunner:
+    """
+    Feeds kline stream updates to two copies of a strategy state: one decides
+    intrabar (debounced), the other only at candle close. Every decision is
+    kept in `decisions` and optionally appended to a CSV file.
+    """
+
+    def __init__(self, symbol, make_state, debouncer=None, on_signal=None, record_path=None):
+        self.symbol = symbol
+        self.intrabar = make_state()
+        self.closing = make_state()
+        self.debouncer = debouncer or Debouncer()
+        self.on_signal = on_signal
+        self.record_path = record_path
+        self.bar_start = None
+        self.decisions = deque(maxlen=100_000)
+
+    def seed(self, closes):
+        self.intrabar.seed(closes)
+        self.closing.seed(closes)
+
+    def _record(self, ts, mode, signal, price):
+        decision = (ts, mode, self.bar_start, signal, price)
+        self.decisions.append(decision)
+        logging.info("%s %s decision: %s at %s", self.symbol, mode, signal, price)
+        if self.record_path:
+            with open(self.record_path, "a", newline="") as f:
+                csv.writer(f).writerow((self.symbol,) + decision)
+
+    def on_update(self, bar_start, price, confirm, ts):
+        if bar_start != self.bar_start:
+            self.bar_start = bar_start
+            self.debouncer.reset()
+        if confirm:
+            signal = self.closing.evaluate(price)
+            if signal:
+                self.closing.apply(signal)
+                self._record(ts, "bar_close", signal, price)
+            self.intrabar.close_bar(price)
+            self.closing.close_bar(price)
+            return
+        signal = self.debouncer.update(self.intrabar.evaluate(price), ts)
+        if signal:
+            self.intrabar.apply(signal)
+            self._record(ts, "intrabar", signal, price)
+            if self.on_signal is not None:
+                self.on_signal(self.symbol, signal, price)
+
+    def handle_message(self, message: dict):
+        """Callback for pybit's WebSocket.kline_stream()."""
+        for k in message.get("data", ()):
+            self.on_update(int(k["start"]), float(k["close"]), k["confirm"], int(k["timestamp"]))
+
+    def summary(self) -> dict:
+        """Compare intrabar and bar-close decisions: counts, matches and how much earlier intrabar fired."""
+        closes = {(d[2], d[3]): d[0] for d in self.decisions if d[1] == "bar_close"}
+        intrabar = [d for d in self.decisions if d[1] == "intrabar"]
+        leads = [closes[(d[2], d[3])] - d[0] for d in intrabar if (d[2], d[3]) in closes]
+        return {
+            "intrabar": len(intrabar),
+            "bar_close": len(closes),
+            "matched": len(leads),
+            "mean_lead_ms": sum(leads) / len(leads) if leads else None,
+        }
+
+
+def main():
+    from pybit.unified_trading import HTTP, WebSocket
+
+    if len(sys.argv) not in (3, 4):
+        print("Error: invalid arguments!!\nYou need SYMBOL TIMEFRAME [sma_rsi|bollinger]")
+        quit()
+    symbol, timeframe = sys.argv[1], sys.argv[2]
+    strategy = sys.argv[3] if len(sys.argv) == 4 else "sma_rsi"
+    make_state = SmaRsiState if strategy == "sma_rsi" else BollingerState
+
+    load_dotenv()
+    session = HTTP(testnet=False, api_key=os.getenv("BYBIT_API_KEY"), api_secret=os.getenv("BYBIT_API_SECRET"))
+    data = parse_kline_response(session.get_kline(category="linear", symbol=symbol, interval=timeframe, limit=200))
+    runner = IntrabarRunner(symbol, make_state, record_path=f"decisions-{symbol}.csv")
+    # the newest candle is still forming
+    runner.seed(data["close"][:-1])
+
+    ws = WebSocket(testnet=False, channel_type="linear")
+    ws.kline_stream(interval=int(timeframe), symbol=symbol, callback=runner.handle_message)
+    try:
+        while True:
+            time.sleep(60)
+            logging.info("Decisions so far: %s", runner.summary())
+    except KeyboardInterrupt:
+        logging.info("Decisions: %s", runner.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -4,18 +4,26 @@ from datetime import datetime
 import math
 import statistics
 import time
+import numpy as np
 from pybit.unified_trading import HTTP
 from dotenv import load_dotenv
 
+import capture
+import profiling
+from cache import ResultCache, code_version, windowed
+
 # Load environment variables
 load_dotenv()
 
-# Initialize the Bybit session
-session = HTTP(
+# Initialize the Bybit session, recorded to CAPTURE_RECORD or replayed from CAPTURE_REPLAY when set
+session = capture.from_env(lambda: HTTP(
     testnet=True,
     api_key=os.getenv("BYBIT_API_KEY"),
     api_secret=os.getenv("BYBIT_API_SECRET")
-)
+))
+
+# Per stage CPU time, allocations and sampled stacks (flame graph) when PROFILE=1
+profiler = profiling.from_env("main-bot-1")
 
 def fetch_klines(symbol, interval, limit=500):
     """
@@ -201,6 +209,9 @@ def place_order(symbol, side, qty, price=None):
     print(f"Placed {side} order: {order}")
     return order
 
+profiler.instrument(globals(), "fetch_klines", "calculate_bollinger_bands", "generate_signals", "place_order")
+profiler.instrument(session, "get_kline", "place_order", prefix="network.")
+
 def main():
     # Parameters (adjust as necessary)
     symbol = "BTCUSDT"
@@ -217,12 +228,26 @@ def main():
 
     # Fetch historical data
     klines = fetch_klines(symbol, interval)
-    
+
     # Calculate Bollinger Bands
-    basis, upper, lower, dev = calculate_bollinger_bands(klines, length, ma_type, mult)
+    if ma_type in ("SMA", "WMA", "VWMA"):
+        # Bands of the candles this window shares with an earlier run are reused, only the newer ones are computed
+        def compute(rows):
+            window = [{"close": c, "volume": v} for c, v in zip(rows["close"].tolist(), rows["volume"].tolist())]
+            return {name: np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+                    for name, values in zip(("basis", "upper", "lower", "dev"),
+                                            calculate_bollinger_bands(window, length, ma_type, mult))}
+        inputs = {name: np.array([k[name] for k in klines], dtype=np.float64) for name in ("close", "volume")}
+        bands = windowed(ResultCache(), ("main-bot-1", length, ma_type, mult, code_version(__file__)),
+                         [k["open_time"] for k in klines], inputs, compute, length)
+        basis, upper, lower, dev = ([None if math.isnan(v) else v for v in bands[name].tolist()]
+                                    for name in ("basis", "upper", "lower", "dev"))
+    else:
+        # EMA / RMA depend on the first candle of the window, so they are computed in full
+        basis, upper, lower, dev = calculate_bollinger_bands(klines, length, ma_type, mult)
     # print(basis, upper, lower, dev)
     # print(basis)
-    
+
     # Generate signals based on our strategy
     signals = generate_signals(klines, basis, upper, lower, dev, start_ts, end_ts)
     
@@ -233,6 +258,19 @@ def main():
         time_str = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
         print(f"{time_str} - {action}: Price={price}, StopLoss={stop_loss}, TakeProfit={take_profit}")
 
+    # Also write candles, bands and signals as Parquet files when COLUMNAR_DIR is set
+    if os.getenv("COLUMNAR_DIR"):
+        import columnar
+        recorder = columnar.Recorder(os.getenv("COLUMNAR_DIR"))
+        nan = float("nan")
+        data = {name: [k.get(name, nan) for k in klines] for name in columnar.KLINE_COLUMNS}
+        bands = {name: [nan if v is None else v for v in values]
+                 for name, values in (("basis", basis), ("upper", upper), ("lower", lower), ("dev", dev))}
+        recorder.klines(symbol, interval, data, bands)
+        for ts, action, price, stop_loss, take_profit in signals:
+            recorder.signal(symbol, ts, action, price, stop_loss, take_profit)
+        recorder.close()
+
     # Example: Place an order based on the latest signal (for live trading, implement continuous monitoring)
     # if signals:
     #     last_signal = signals[-1]
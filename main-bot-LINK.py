@@ -9,6 +9,8 @@ from dotenv import load_dotenv
 
 import pandas as pd
 
+import profiling
+
 # Load environment variables
 load_dotenv()
 
@@ -22,6 +24,9 @@ session = HTTP(
     api_secret=os.getenv("BYBIT_API_SECRET")
 )
 
+# Per stage CPU time, allocations and sampled stacks (flame graph) when PROFILE=1
+profiler = profiling.from_env("main-bot-LINK")
+
 # Strategy parameters
 symbol = "LINKUSDT"
 fast_length = 9
@@ -132,6 +137,10 @@ def close_position(side, qty):
     except Exception as e:
         logging.error("Exception in close_position: %s", e)
 
+profiler.instrument(globals(), "fetch_klines", "calculate_indicators", "generate_signals", "get_open_position",
+                    "place_order", "close_position")
+profiler.instrument(session, "get_kline", "get_positions", "place_order", prefix="network.")
+
 def main():
     qty = 0.6  # Adjust the trade quantity as needed
     while True:
@@ -170,7 +179,8 @@ def main():
         # Sleep duration: adjust sleep time based on timeframe (60 seconds for 1-min, 300 for 5-min)
         # sleep_time = 60 if timeframe == "1" else 300
         sleep_time = 60  # 15-minute timeframe
-        time.sleep(sleep_time)
+        with profiler.stage(profiling.IDLE):
+            time.sleep(sleep_time)
 
 if __name__ == '__main__':
     main()
@@ -1,13 +1,25 @@
 
 import os
 import logging
-import time
 from pybit.unified_trading import HTTP
 from ta.trend import SMAIndicator
 from ta.momentum import RSIIndicator
 from dotenv import load_dotenv
 import sys
 
+from klines import KLINE_COLUMNS, parse_kline_response
+import marketdata
+import validate
+import columnar
+import capture
+import profiling
+from risk import RiskEngine
+from clocksync import ClockSync
+from hedging import HedgedSession
+from instruments import InstrumentCache
+from prewarm import PreClose
+from orders import OrderManager, PENDING
+
 import pandas as pd
 
 # Load environment variables
@@ -32,11 +44,27 @@ elif sys.argv[3] not in TIMEFRAMES:
 	quit()
 
 # Initialize the Bybit session
-session = HTTP(
+# Slow reads are hedged and orders carry an orderLinkId so they can be retried safely
+# With CAPTURE_RECORD / CAPTURE_REPLAY set, the session is recorded to or replayed from a capture file
+session = capture.from_env(lambda: HedgedSession(HTTP(
     testnet=False,
     api_key=os.getenv("BYBIT_API_KEY"),
     api_secret=os.getenv("BYBIT_API_SECRET")
-)
+)))
+
+# Pre-trade risk limits, checked locally before every order
+risk = RiskEngine()
+
+# Offset to server time, used to sign requests and to wake up at candle close
+clock = session.clock() if isinstance(session, capture.ReplaySession) else ClockSync(session)
+# Wait this long after the candle close so the exchange has rolled over to the new candle
+CLOSE_DELAY_MS = 200
+
+# Tick size / qty step of every linear symbol, used to round the prepared orders
+instruments = InstrumentCache(session)
+# Warm connections and prepare orders this many ms before every candle close
+PRECLOSE_MS = int(os.getenv("PRECLOSE_MS", "1500"))
+preclose = PreClose(session, instruments)
 
 # Strategy parameters
 symbol = sys.argv[1]
@@ -49,29 +77,53 @@ rsi_length = 14
 rsi_overbought = 70
 rsi_oversold = 30
 
+# Read candles from a running marketdata.py feed instead of the API when MARKETDATA_BUS=1
+bus = None
+if os.getenv("MARKETDATA_BUS") == "1":
+    try:
+        bus = marketdata.MarketData(symbol, timeframe)
+    except FileNotFoundError:
+        logging.error("No market data feed for %s %s, fetching klines from the API", symbol, timeframe)
+
+# Per stage CPU time, allocations and sampled stacks (flame graph) when PROFILE=1
+profiler = profiling.from_env("main-bot")
+
+# Record candles, indicators, signals and orders as Parquet files when COLUMNAR_DIR is set
+recorder = columnar.Recorder(os.getenv("COLUMNAR_DIR")) if os.getenv("COLUMNAR_DIR") else None
+
+def record_candles(df):
+    """Record the closed candles of the frame with their indicator values."""
+    closed = df.iloc[:-1]
+    data = {c: closed[c].to_numpy() for c in KLINE_COLUMNS[1:]}
+    data['open_time'] = closed.index.asi8 // 1_000_000
+    recorder.klines(symbol, timeframe, data, {c: closed[c].to_numpy() for c in ('fast_sma', 'slow_sma', 'rsi')})
+
+def klines_frame(data):
+    index = pd.to_datetime(data['open_time'], unit='ms')
+    index.name = 'open_time'
+    return pd.DataFrame({c: data[c] for c in KLINE_COLUMNS[1:]}, index=index, copy=False)
+
 def fetch_klines(symbol, interval, limit=200):
-    """Fetch historical kline data from Bybit."""
+    """Fetch historical kline data from Bybit, oldest candle first."""
     try:
+        if bus is not None and (symbol, interval) == (bus.symbol, timeframe):
+            try:
+                return klines_frame(bus.klines(limit))
+            except marketdata.StaleFeed as e:
+                logging.warning("%s, fetching klines from the API", e)
         response = session.get_kline(symbol=symbol, interval=interval, limit=limit)
         if response['retCode'] != 0:
             logging.error("Error fetching klines: %s", response)
             return None
-        # data = response['result']
-        # df = pd.DataFrame(data)
-        # 🔍 Debugging: Print raw response to verify data structure
-        # logging.info("Klines Response: %s", response)
-
-        columns = ['open_time', 'open', 'high', 'low', 'close', 'volume', 'turnover']
-        df = pd.DataFrame(response['result']['list'], columns=columns)
-
-        # df['open_time'] = pd.to_datetime(df['open_time'], unit='s')
-        df['open_time'] = pd.to_datetime(df['open_time'].astype(float), unit='ms')
-        df.set_index('open_time', inplace=True)
-        df = df.astype(float)
-
-        # 🔍 Debugging: Print first few rows to confirm correct data
-        # logging.info("Klines DataFrame:\n%s", df.head())
-        return df
+
+        data = parse_kline_response(response)
+        step = validate.interval_ms(interval)
+        report = validate.validate(data, step)
+        if not report['ok']:
+            logging.warning("Kline quality %s %s: %s", symbol, interval, validate.summary(report))
+            data, report = validate.repair(data, step, validate.session_fetcher(session, symbol, interval))
+            logging.info("Klines after repair: %s", validate.summary(report))
+        return klines_frame(data)
     except Exception as e:
         logging.error("Exception in fetch_klines: %s", e)
         return None
@@ -116,13 +168,32 @@ def get_open_position():
         logging.error("Exception in get_open_position: %s", e)
         return None
 
+def order_update(order, previous):
+    """Called by the order manager on every state change of an order."""
+    logging.info("Order %s: %s -> %s", order, previous, order.state)
+    if recorder and previous == PENDING:
+        recorder.order(order.symbol, order.side, order.order_type, order.qty, order.price, order.reduce_only,
+                       response=order.response or {"retMsg": order.reason or ""})
+
+# Orders are sent in the background and followed through acks and fills, so the loop never waits on them
+# Fills move the risk engine's positions
+# A replay places orders one at a time, so they take the capture's records in a fixed order
+orders = OrderManager(session, on_update=order_update,
+                      max_workers=1 if isinstance(session, capture.ReplaySession) else 8,
+                      on_fill=lambda order, qty, price: risk.on_fill(order.symbol, order.side, qty, price))
+
 def place_order2(side, qty):
 	print("Order placed: ", side, qty)
 
 def place_order(side, qty):
-    """Place a market order."""
+    """Place a market order, using the order prepared before the close if there is one."""
+    reason = risk.check_order(symbol, side, qty)
+    if reason:
+        logging.error("Order rejected by risk check: %s", reason)
+        return
     try:
-        order = session.place_order(
+        prepared = preclose.take("open", side, qty)
+        order = orders.submit_prepared(prepared) if prepared else orders.submit(
             category="linear",
             symbol=symbol,
             side=side,
@@ -132,10 +203,8 @@ def place_order(side, qty):
             reduce_only=False,
             close_on_trigger=False
         )
-        if order['retCode'] != 0:
-            logging.error("Order error: %s", order)
-        else:
-            logging.info("Order placed: %s", order)
+        logging.info("Order submitted: %s", order)
+        return order
     except Exception as e:
         logging.error("Exception in place_order: %s", e)
 
@@ -144,8 +213,13 @@ def close_position2(side, qty):
 	
 def close_position(side, qty):
     """Close an existing position using a market order."""
+    reason = risk.check_order(symbol, side, qty, reduce_only=True)
+    if reason:
+        logging.error("Close order rejected by risk check: %s", reason)
+        return
     try:
-        order = session.place_order(
+        prepared = preclose.take("close", side, qty)
+        order = orders.submit_prepared(prepared) if prepared else orders.submit(
             category="linear",
             symbol=symbol,
             side=side,
@@ -155,20 +229,49 @@ def close_position(side, qty):
             reduceOnly=True,
             closeOnTrigger=True
         )
-        if order['retCode'] != 0:
-            logging.error("Close order error: %s", order)
-        else:
-            logging.info("Position closed: %s", order)
+        logging.info("Close order submitted: %s", order)
+        return order
     except Exception as e:
         logging.error("Exception in close_position: %s", e)
 
+profiler.instrument(globals(), "fetch_klines", "klines_frame", "calculate_indicators", "generate_signals",
+                    "get_open_position", "place_order", "close_position", "record_candles")
+profiler.instrument(session, "get_kline", "get_positions", "place_order", prefix="network.")
+
 def main():
+    # A replay refreshes the risk engine and reconciles orders in the loop instead of in background threads,
+    # so every run draws the same records of the capture in the same order
+    replay = isinstance(session, capture.ReplaySession)
+    if not replay:
+        risk.start(session)
+        orders.start()
+    clock.start()
+    # private order / execution pushes; without them the order manager polls stale orders
+    if not capture.enabled():
+        try:
+            orders.connect(api_key=os.getenv("BYBIT_API_KEY"), api_secret=os.getenv("BYBIT_API_SECRET"))
+        except Exception as e:
+            logging.error("Could not connect the private websocket: %s", e)
+    loops = 0
+    last_price = None
     while True:
+        if replay:
+            try:
+                risk.refresh(session)
+                orders.reconcile()
+            except Exception as e:
+                logging.error("Exception in replayed refresh: %s", e)
         df = fetch_klines(symbol, interval=timeframe)
         if df is not None:
+            last_price = df['close'].iloc[-1]
+            risk.update_price(symbol, last_price)
             df = calculate_indicators(df)
             signal = generate_signals(df)
             open_pos = get_open_position()
+            if recorder:
+                record_candles(df)
+                if signal:
+                    recorder.signal(symbol, df.index[-1].value // 1_000_000, signal, df['close'].iloc[-1])
             
             logging.info("Generated signal: %s", signal)
             # Manage open positions
@@ -196,10 +299,30 @@ def main():
         else:
             logging.error("Failed to fetch kline data.")
         
-        # Sleep duration: adjust sleep time based on timeframe (60 seconds for 1-min, 300 for 5-min)
-        sleep_time = 60 if timeframe == "1" else 300
-        # sleep_time = 10  # 15-minute timeframe
-        time.sleep(sleep_time)
+        loops += 1
+        if loops % 60 == 0:
+            session.log_report()
+        # the errors of a replay that ran out of records were caught and logged above
+        if isinstance(session, capture.ReplaySession) and session.exhausted:
+            logging.info("End of the capture")
+            session.log_report()
+            break
+
+        # Sleep until just before the next candle close on the server clock (every 1 or 5 minutes),
+        # get the orders ready, then wake up right after the close
+        close_ms = clock.next_close(validate.interval_ms(timeframe))
+        with profiler.stage(profiling.IDLE):
+            clock.sleep_until(close_ms - PRECLOSE_MS)
+        # prepared orders bypass the session, so they are not used while recording or replaying
+        if not capture.enabled():
+            try:
+                with profiler.stage("preclose"):
+                    pos = get_open_position()
+                    preclose.run(symbol, qty, pos['side'] if pos else None, pos['size'] if pos else 0, last_price)
+            except Exception as e:
+                logging.error("Exception in pre-close: %s", e)
+        with profiler.stage(profiling.IDLE):
+            clock.sleep_until(close_ms + CLOSE_DELAY_MS)
 
 if __name__ == '__main__':
     main()
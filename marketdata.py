@@ -0,0 +1,384 @@
+# marketdata.py
+"""
+Market data bus: one feed process per symbol publishes candles and trades into
+shared-memory ring buffers, and any number of strategy processes on the same
+machine read them without calling the API themselves.
+
+Each symbol has three rings:
+    bars   closed candles (KLINE_COLUMNS), seeded with get_kline history
+    live   updates of the forming candle
+    ticks  public trades: ts, price, size, side (+1 buy, -1 sell)
+
+Every record gets a sequence number. Readers keep their own position, get
+numpy views straight into shared memory, and are told how many records they
+missed if the writer lapped them.
+
+The ring header also holds a generation number, the writer's pid and a
+heartbeat the writer refreshes every second. A restarted feed retires the
+rings of the dead one, and MarketData reattaches to the new rings, or raises
+StaleFeed when the feed is gone, so a reader never keeps serving frozen
+candles.
+
+Usage: python marketdata.py TIMEFRAME SYMBOL [SYMBOL ...]
+"""
+import logging
+import multiprocessing as mp
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from klines import KLINE_COLUMNS, parse_kline_response
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+TICK_FIELDS = ("ts", "price", "size", "side")
+BARS_CAPACITY = 10_000
+LIVE_CAPACITY = 256
+TICKS_CAPACITY = 1 << 20
+
+_HEAD, _CAPACITY, _WIDTH, _GENERATION, _HEARTBEAT, _PID = range(6)
+_HEADER = 8  # int64 words
+RETIRED = -1  # generation of a ring whose writer closed it or was replaced
+
+# A ring whose heartbeat is older than this has no live writer
+STALE_AFTER_MS = 10_000
+HEARTBEAT_S = 1.0
+
+# rings created by this process (or its parent before the fork); they share our resource tracker
+_created = set()
+
+
+class StaleFeed(RuntimeError):
+    """The feed behind a ring stopped or was replaced and no live ring could be attached."""
+
+
+def ring_name(symbol: str, kind: str, interval: str=None) -> str:
+    return f"bybit_{symbol}_{interval}_{kind}" if interval else f"bybit_{symbol}_{kind}"
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Ring:
+    """
+    Single-writer ring buffer of fixed-width float64 records in shared memory.
+
+    Layout: int64 header (head, capacity, width, generation, heartbeat ms,
+    writer pid), int64 sequence number per slot, then the records. The writer
+    marks a slot -1 while writing it and advances head after it is complete.
+    """
+
+    def __init__(self, name: str, capacity: int=None, width: int=None, create: bool=False):
+        self.name = name
+        if create:
+            size = 8 * (_HEADER + capacity + capacity * width)
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                self._retire_existing(name)
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _created.add(name)
+        elif name in _created:
+            self.shm = shared_memory.SharedMemory(name=name)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # Python < 3.13 registers attached segments too and would unlink them when this process exits
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        if create:
+            self.header[:] = 0
+            self.header[_CAPACITY], self.header[_WIDTH] = capacity, width
+            self.header[_GENERATION] = time.time_ns()
+            self.header[_PID] = os.getpid()
+            self.header[_HEARTBEAT] = _now_ms()
+        self.generation = int(self.header[_GENERATION])
+        self.capacity = int(self.header[_CAPACITY])
+        self.width = int(self.header[_WIDTH])
+        self.seqs = np.ndarray((self.capacity,), dtype=np.int64, buffer=self.shm.buf, offset=8 * _HEADER)
+        self.data = np.ndarray((self.capacity, self.width), dtype=np.float64, buffer=self.shm.buf,
+                               offset=8 * (_HEADER + self.capacity))
+        if create:
+            self.seqs[:] = -1
+        self.owner = create
+
+    @staticmethod
+    def _retire_existing(name):
+        """
+        Unlink a segment left behind by a feed that died, after marking it
+        retired for readers still attached to it. Refuses while its writer is alive.
+        """
+        old = shared_memory.SharedMemory(name=name)
+        pid = heartbeat = 0
+        if old.size >= 8 * _HEADER:
+            header = np.ndarray((_HEADER,), dtype=np.int64, buffer=old.buf)
+            pid, heartbeat = int(header[_PID]), int(header[_HEARTBEAT])
+            live = pid != os.getpid() and _pid_alive(pid) and _now_ms() - heartbeat < STALE_AFTER_MS
+            if not live:
+                header[_GENERATION] = RETIRED
+            del header
+            if live:
+                old.close()
+                raise RuntimeError(f"{name} is in use by the live feed process {pid}")
+        old.close()
+        old.unlink()
+
+    @property
+    def retired(self) -> bool:
+        """True once the writer closed this ring or a new feed replaced it."""
+        return int(self.header[_GENERATION]) != self.generation
+
+    def stale(self, max_age_ms: int=STALE_AFTER_MS) -> bool:
+        """True if the ring was retired or its writer has not beaten for max_age_ms."""
+        return self.retired or _now_ms() - int(self.header[_HEARTBEAT]) > max_age_ms
+
+    def beat(self):
+        """Writer heartbeat."""
+        self.header[_HEARTBEAT] = _now_ms()
+
+    @property
+    def head(self) -> int:
+        """Sequence number the next record will get."""
+        return int(self.header[_HEAD])
+
+    def publish(self, record):
+        seq = int(self.header[_HEAD])
+        slot = seq % self.capacity
+        self.seqs[slot] = -1
+        self.data[slot] = record
+        self.seqs[slot] = seq
+        self.header[_HEAD] = seq + 1
+        return seq
+
+    def publish_many(self, records):
+        """Publish rows of a 2-D array, oldest first."""
+        for record in np.asarray(records, dtype=np.float64)[-self.capacity:]:
+            self.publish(record)
+
+    def close(self):
+        if self.owner:
+            self.header[_GENERATION] = RETIRED
+        self.header = self.seqs = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.name)
+
+
+class RingReader:
+    """A consumer position in a Ring. Starts at the oldest record still available, or at the head."""
+
+    def __init__(self, ring: Ring, from_start: bool=True):
+        self.ring = ring
+        head = ring.head
+        self.next_seq = max(head - ring.capacity, 0) if from_start else head
+        self.lost = 0
+
+    def read(self, max_items: int=None):
+        """
+        Records published since the last read, as (first_seq, view, lost).
+        The view points into shared memory and holds at most the records up to
+        the end of the buffer; call again for the rest. `lost` is how many
+        records were overwritten before they could be read. Raises StaleFeed
+        once the ring was replaced; make a new reader from MarketData then.
+        """
+        ring = self.ring
+        if ring.retired:
+            raise StaleFeed(f"{ring.name} was replaced by a new feed")
+        head = ring.head
+        lost = 0
+        if head - self.next_seq > ring.capacity:
+            lost = head - ring.capacity - self.next_seq
+            self.next_seq = head - ring.capacity
+        start = self.next_seq % ring.capacity
+        n = min(head - self.next_seq, ring.capacity - start)
+        if max_items is not None:
+            n = min(n, max_items)
+        seq = self.next_seq
+        self.next_seq += n
+        self.lost += lost
+        return seq, ring.data[start:start + n], lost
+
+    def valid(self, seq: int) -> bool:
+        """True if the record `seq` (and everything read after it) has not been overwritten since."""
+        return self.ring.head - seq <= self.ring.capacity and self.ring.seqs[seq % self.ring.capacity] == seq
+
+    def read_copy(self, max_items: int=None):
+        """Like read(), but returns a copy that is checked against overwrites while copying."""
+        while True:
+            seq, view, lost = self.read(max_items)
+            out = view.copy()
+            if len(out) == 0 or self.valid(seq):
+                return seq, out, lost
+            # lapped while copying: count the records we lost and retry from the oldest slot
+            self.next_seq = seq
+
+
+def latest(ring: Ring, n: int) -> np.ndarray:
+    """Copy of the last n records of a ring, oldest first."""
+    while True:
+        head = ring.head
+        n = min(n, head, ring.capacity)
+        first = head - n
+        out = ring.data[np.arange(first, head) % ring.capacity]
+        if n == 0 or (ring.seqs[first % ring.capacity] == first and ring.head - first <= ring.capacity):
+            return out
+
+
+class MarketData:
+    """
+    Read side of the bus for one symbol and candle interval. Before every
+    read it checks that the feed is alive, reattaching to the rings of a
+    restarted feed; StaleFeed means there is no live feed to read from.
+    """
+
+    KINDS = ("bars", "live", "ticks")
+
+    def __init__(self, symbol: str, interval: str, stale_after_ms: int=STALE_AFTER_MS):
+        self.symbol = symbol
+        self.interval = interval
+        self.stale_after_ms = stale_after_ms
+        self.reattached = 0
+        for kind in self.KINDS:
+            setattr(self, kind, Ring(ring_name(symbol, kind, interval)))
+
+    def check(self):
+        """Reattach rings that were replaced by a restarted feed. Raises StaleFeed when no live feed is found."""
+        for kind in self.KINDS:
+            ring = getattr(self, kind)
+            if not ring.stale(self.stale_after_ms):
+                continue
+            try:
+                new = Ring(ring_name(self.symbol, kind, self.interval))
+            except FileNotFoundError:
+                raise StaleFeed(f"No market data feed for {self.symbol} {self.interval}") from None
+            if new.generation == ring.generation or new.stale(self.stale_after_ms):
+                new.close()
+                raise StaleFeed(f"Market data feed for {self.symbol} {self.interval} stopped")
+            ring.close()
+            setattr(self, kind, new)
+            self.reattached += 1
+            logging.warning("Reattached to the restarted %s feed of %s %s", kind, self.symbol, self.interval)
+
+    def klines(self, limit: int=200, include_forming: bool=True) -> dict:
+        """
+        The last `limit` candles as a dict of arrays keyed by KLINE_COLUMNS,
+        oldest first, like klines.parse_kline_response(). With include_forming
+        the current candle is the last row, as get_kline returns it.
+        """
+        self.check()
+        rows = latest(self.bars, limit)
+        if include_forming:
+            forming = latest(self.live, 1)
+            if len(forming) and (len(rows) == 0 or forming[0, 0] > rows[-1, 0]):
+                rows = np.vstack([rows[1:] if len(rows) >= limit else rows, forming])
+        out = {name: np.ascontiguousarray(rows[:, i]) for i, name in enumerate(KLINE_COLUMNS)}
+        out["open_time"] = out["open_time"].astype(np.int64)
+        return out
+
+    def tick_reader(self, from_start: bool=False) -> RingReader:
+        self.check()
+        return RingReader(self.ticks, from_start)
+
+    def close(self):
+        for ring in (self.bars, self.live, self.ticks):
+            ring.close()
+
+
+def run_feed(symbol: str, interval: str, testnet: bool=False):
+    """Feed process: history once from REST, then websocket candles and trades for one symbol."""
+    from pybit.unified_trading import HTTP, WebSocket
+
+    bars = Ring(ring_name(symbol, "bars", interval), BARS_CAPACITY, len(KLINE_COLUMNS), create=True)
+    live = Ring(ring_name(symbol, "live", interval), LIVE_CAPACITY, len(KLINE_COLUMNS), create=True)
+    ticks = Ring(ring_name(symbol, "ticks", interval), TICKS_CAPACITY, len(TICK_FIELDS), create=True)
+    try:
+        session = HTTP(testnet=testnet)
+        data = parse_kline_response(session.get_kline(category="linear", symbol=symbol, interval=interval, limit=1000))
+        # the newest candle is still forming
+        history = np.column_stack([data[name] for name in KLINE_COLUMNS]).astype(np.float64)
+        bars.publish_many(history[:-1])
+        if len(history):
+            live.publish(history[-1])
+        last_closed = history[-2, 0] if len(history) > 1 else -1.0
+
+        def on_kline(message):
+            nonlocal last_closed
+            for k in message.get("data", ()):
+                record = (float(k["start"]), float(k["open"]), float(k["high"]), float(k["low"]),
+                          float(k["close"]), float(k["volume"]), float(k["turnover"]))
+                if k["confirm"]:
+                    if record[0] > last_closed:
+                        bars.publish(record)
+                        last_closed = record[0]
+                else:
+                    live.publish(record)
+
+        def on_trade(message):
+            for t in message.get("data", ()):
+                ticks.publish((float(t["T"]), float(t["p"]), float(t["v"]), 1.0 if t["S"] == "Buy" else -1.0))
+
+        ws = WebSocket(testnet=testnet, channel_type="linear")
+        ws.kline_stream(interval=int(interval), symbol=symbol, callback=on_kline)
+        ws.trade_stream(symbol=symbol, callback=on_trade)
+        logging.info("Feed %s %s started with %d bars of history", symbol, interval, bars.head)
+        beats = 0
+        while True:
+            time.sleep(HEARTBEAT_S)
+            for ring in (bars, live, ticks):
+                ring.beat()
+            beats += 1
+            if beats % 60 == 0:
+                logging.info("Feed %s: %d bars, %d ticks published", symbol, bars.head, ticks.head)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for ring in (bars, live, ticks):
+            ring.close()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print("Error: invalid arguments!!\nYou need TIMEFRAME SYMBOL [SYMBOL ...]")
+        quit()
+    interval = sys.argv[1]
+    procs = {}
+
+    def start(symbol):
+        procs[symbol] = mp.Process(target=run_feed, args=(symbol, interval), name=f"feed-{symbol}")
+        procs[symbol].start()
+
+    for symbol in sys.argv[2:]:
+        start(symbol)
+    try:
+        while True:
+            time.sleep(10)
+            for symbol, proc in list(procs.items()):
+                if not proc.is_alive():
+                    logging.error("Feed %s died, restarting", symbol)
+                    start(symbol)
+    except KeyboardInterrupt:
+        for proc in procs.values():
+            proc.join()
+
+
+if __name__ == '__main__':
+    main()
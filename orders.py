@@ -0,0 +1,387 @@
+# orders.py
+"""
+Asynchronous order management.
+
+OrderManager.submit() returns at once with an Order in state PENDING; the
+REST request runs on a worker thread. The order then moves through NEW,
+PARTIALLY_FILLED, FILLED, CANCELLED and REJECTED as the REST response and
+the private 'order' and 'execution' websocket pushes come in, whichever is
+first. Every order carries an orderLinkId, so pushes can be matched to it
+before the REST response arrives, and orders placed elsewhere on the
+account are tracked from their pushes as well.
+
+Without websocket (or when it drops messages), reconcile() polls the
+exchange for orders that have not been updated for a while; it runs every
+`reconcile_interval` seconds once start() is called.
+
+Only a Bybit retCode rejects an order outright. After a network error or an
+HTTP error status the order is looked up instead, and an order rejected
+because the exchange did not know it yet is still moved on by a later push.
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from pybit.exceptions import InvalidRequestError
+
+PENDING = "pending"
+NEW = "new"
+PARTIALLY_FILLED = "partially_filled"
+FILLED = "filled"
+CANCELLED = "cancelled"
+REJECTED = "rejected"
+
+TERMINAL = {FILLED, CANCELLED, REJECTED}
+_RANK = {PENDING: 0, NEW: 1, PARTIALLY_FILLED: 2, FILLED: 3, CANCELLED: 3, REJECTED: 3}
+
+# Bybit orderStatus -> state
+ORDER_STATUS = {
+    "Created": NEW, "New": NEW, "Untriggered": NEW, "Triggered": NEW, "Active": NEW,
+    "PartiallyFilled": PARTIALLY_FILLED, "Filled": FILLED,
+    "Cancelled": CANCELLED, "PartiallyFilledCanceled": CANCELLED, "Deactivated": CANCELLED,
+    "Rejected": REJECTED,
+}
+
+# Bybit retCode of a cancel for an order that is already filled or cancelled
+ORDER_NOT_EXISTS = 110001
+
+
+def _param(params: dict, *names, default=None):
+    for name in names:
+        if params.get(name) is not None:
+            return params[name]
+    return default
+
+
+class Order:
+
+    def __init__(self, link_id: str, symbol: str, side: str, qty: float, order_type: str="Market",
+                 price: float=None, reduce_only: bool=False, category: str="linear", params: dict=None):
+        self.link_id = link_id
+        self.symbol = symbol
+        self.side = side
+        self.qty = qty
+        self.order_type = order_type
+        self.price = price
+        self.reduce_only = reduce_only
+        self.category = category
+        self.params = params or {}
+        self.state = PENDING
+        self.order_id = None
+        self.filled_qty = 0.0
+        self.avg_price = None
+        self.fees = 0.0
+        self.executions = {}  # execId -> (price, qty, fee)
+        self.reason = None
+        self.inferred = False  # REJECTED by the manager, not by the exchange
+        self.response = None
+        self.created = time.time()
+        self.updated = self.created
+        self.acked = threading.Event()  # left PENDING
+        self.done = threading.Event()  # reached a terminal state
+
+    @property
+    def active(self) -> bool:
+        return self.state not in TERMINAL
+
+    @property
+    def remaining_qty(self) -> float:
+        return max(self.qty - self.filled_qty, 0.0)
+
+    def __repr__(self):
+        return (f"Order({self.link_id} {self.symbol} {self.side} {self.order_type} {self.filled_qty:g}/{self.qty:g}"
+                f" {self.state}{f' ({self.reason})' if self.reason else ''})")
+
+
+class OrderManager:
+    """
+    Tracks orders of a pybit HTTP session (or HedgedSession). on_update is
+    called as on_update(order, previous_state) after every state change and
+    on_fill as on_fill(order, qty, price) for every increase of the filled
+    quantity, on the thread that caused it.
+    """
+
+    def __init__(self, session, on_update=None, category: str="linear", max_workers: int=8,
+                 reconcile_interval: float=5.0, stale_after: float=10.0, keep_done: int=1000, on_fill=None):
+        self.session = session
+        self.on_update = on_update
+        self.on_fill = on_fill
+        self.category = category
+        self.reconcile_interval = reconcile_interval
+        self.stale_after = stale_after
+        self.keep_done = keep_done
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orders")
+        self.orders = {}  # orderLinkId -> Order
+        self.by_id = {}  # orderId -> Order
+        self.done = []  # link ids of finished orders, oldest first
+        self.ws = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # submitting
+
+    def submit(self, send=None, **params) -> Order:
+        """
+        Place an order without waiting for the response. params are the
+        place_order arguments; send, when given, is called instead of
+        session.place_order (e.g. prewarm.PreparedOrder.send).
+        """
+        params = dict(params, category=params.get("category", self.category))
+        link_id = params.get("orderLinkId") or params.get("order_link_id") or uuid.uuid4().hex
+        if "order_link_id" not in params:
+            params["orderLinkId"] = link_id
+        order = Order(link_id, params["symbol"], params["side"], float(params["qty"]),
+                      _param(params, "orderType", "order_type", default="Market"), _param(params, "price"),
+                      bool(_param(params, "reduceOnly", "reduce_only", default=False)), params["category"], params)
+        with self._lock:
+            self.orders[link_id] = order
+        self.executor.submit(self._place, order, send or (lambda: self.session.place_order(**params)))
+        return order
+
+    def submit_prepared(self, prepared) -> Order:
+        """Submit a prewarm.PreparedOrder."""
+        return self.submit(send=prepared.send, **prepared.params)
+
+    def _place(self, order: Order, send):
+        try:
+            res = send()
+        except InvalidRequestError as e:
+            self._reject(order, e.message)
+            return
+        except Exception as e:
+            # network error or HTTP error status: the request may or may not have reached the exchange
+            logging.warning("Order %s: %s, looking it up", order.link_id, e)
+            self._lookup(order)
+            return
+        order.response = res
+        if res.get("retCode") != 0:
+            self._reject(order, res.get("retMsg"))
+            return
+        with self._lock:
+            order.order_id = res["result"].get("orderId") or order.order_id
+            if order.link_id in self.orders:  # not yet finished and forgotten
+                self.by_id[order.order_id] = order
+            self._transition(order, NEW)
+
+    def _reject(self, order, reason, inferred: bool=False):
+        with self._lock:
+            order.reason = reason
+            order.inferred = inferred
+            self._transition(order, REJECTED)
+
+    def cancel(self, order, symbol: str=None) -> Order:
+        """
+        Cancel an order (Order, orderLinkId or orderId) without waiting; its
+        state changes on the push. An orderId placed before this manager
+        existed is tracked from now on, given its symbol.
+        """
+        with self._lock:
+            if not isinstance(order, Order):
+                key = order
+                order = self.orders.get(key) or self.by_id.get(key)
+                if order is None and symbol:
+                    order = self._order_for({"orderId": key, "symbol": symbol, "side": None})
+            if order is None or not order.active:
+                return order
+        self.executor.submit(self._cancel, order)
+        return order
+
+    def _cancel(self, order: Order):
+        kwargs = {"category": order.category, "symbol": order.symbol}
+        if order.order_id:
+            kwargs["orderId"] = order.order_id
+        else:
+            kwargs["orderLinkId"] = order.link_id
+        try:
+            res = self.session.cancel_order(**kwargs)
+        except Exception as e:
+            res = {"retCode": getattr(e, "status_code", None), "retMsg": str(e)}
+        if res.get("retCode") not in (0, ORDER_NOT_EXISTS):
+            logging.error("Cancel of %s failed: %s", order, res.get("retMsg"))
+
+    def cancel_all(self, symbol: str=None):
+        for order in self.open_orders(symbol):
+            self.cancel(order)
+
+    # state
+
+    def _transition(self, order: Order, state: str, exchange: bool=False):
+        """
+        Move order to state unless that would go backwards. Only an exchange
+        update (exchange=True) may move an order out of a REJECTED state that
+        the manager inferred. Call with the lock held.
+        """
+        if state == order.state:
+            return
+        if order.state == REJECTED and order.inferred and exchange:
+            order.inferred = False
+            order.reason = None
+            order.done.clear()
+        elif order.state in TERMINAL or _RANK[state] < _RANK[order.state]:
+            return
+        previous = order.state
+        order.state = state
+        order.updated = time.time()
+        order.acked.set()
+        if state in TERMINAL:
+            order.done.set()
+            if order.link_id not in self.done:
+                self.done.append(order.link_id)
+            while len(self.done) > self.keep_done:
+                old = self.orders.pop(self.done.pop(0), None)
+                if old is not None:
+                    self.by_id.pop(old.order_id, None)
+        if self.on_update is not None:
+            try:
+                self.on_update(order, previous)
+            except Exception as e:
+                logging.error("Exception in order update callback: %s", e)
+
+    def _filled(self, order: Order, before: float, price):
+        """Report the fill since filled_qty was `before`. Call with the lock held."""
+        if self.on_fill is not None and order.filled_qty > before:
+            try:
+                self.on_fill(order, order.filled_qty - before, price)
+            except Exception as e:
+                logging.error("Exception in order fill callback: %s", e)
+
+    def _order_for(self, msg: dict) -> Order:
+        """The tracked order of a push or REST record, tracking it when it was placed elsewhere."""
+        order = self.orders.get(msg.get("orderLinkId")) or self.by_id.get(msg.get("orderId"))
+        if order is None:
+            link_id = msg.get("orderLinkId") or msg["orderId"]
+            order = Order(link_id, msg["symbol"], msg["side"], float(msg.get("qty") or msg.get("orderQty") or 0),
+                          msg.get("orderType", "Market"), float(msg["price"]) if msg.get("price") else None,
+                          bool(msg.get("reduceOnly")), msg.get("category", self.category))
+            self.orders[link_id] = order
+        if msg.get("orderId") and not order.order_id:
+            order.order_id = msg["orderId"]
+            self.by_id[order.order_id] = order
+        return order
+
+    def apply_order(self, msg: dict):
+        """Apply one order record (websocket 'order' push or get_open_orders / get_order_history row)."""
+        with self._lock:
+            order = self._order_for(msg)
+            filled = order.filled_qty
+            if msg.get("cumExecQty"):
+                order.filled_qty = max(order.filled_qty, float(msg["cumExecQty"]))
+            if msg.get("avgPrice") and float(msg["avgPrice"]):
+                order.avg_price = float(msg["avgPrice"])
+            self._filled(order, filled, order.avg_price)
+            if msg.get("cumExecFee"):
+                order.fees = max(order.fees, float(msg["cumExecFee"]))
+            state = ORDER_STATUS.get(msg.get("orderStatus"))
+            if state == REJECTED or (state == CANCELLED and msg.get("rejectReason") not in (None, "", "EC_NoError")):
+                order.reason = msg.get("rejectReason") or order.reason
+            if state is not None:
+                self._transition(order, state, exchange=True)
+
+    def apply_execution(self, msg: dict):
+        """Apply one fill (websocket 'execution' push)."""
+        if msg.get("execType", "Trade") != "Trade":
+            return  # funding, settlement, ...
+        with self._lock:
+            order = self._order_for(msg)
+            if msg["execId"] in order.executions:
+                return
+            order.executions[msg["execId"]] = (float(msg["execPrice"]), float(msg["execQty"]),
+                                               float(msg.get("execFee") or 0))
+            filled = sum(q for _, q, _ in order.executions.values())
+            if filled > order.filled_qty:
+                before = order.filled_qty
+                order.avg_price = sum(p * q for p, q, _ in order.executions.values()) / filled
+                order.filled_qty = filled
+                self._filled(order, before, float(msg["execPrice"]))
+            order.fees = max(order.fees, sum(f for _, _, f in order.executions.values()))
+            if order.qty and order.filled_qty >= order.qty - 1e-12:
+                self._transition(order, FILLED, exchange=True)
+            else:
+                self._transition(order, PARTIALLY_FILLED, exchange=True)
+
+    def on_order_message(self, message: dict):
+        for msg in message.get("data", []):
+            self.apply_order(msg)
+
+    def on_execution_message(self, message: dict):
+        for msg in message.get("data", []):
+            self.apply_execution(msg)
+
+    # queries
+
+    def get(self, key) -> Order:
+        """Order by orderLinkId or orderId."""
+        with self._lock:
+            return self.orders.get(key) or self.by_id.get(key)
+
+    def open_orders(self, symbol: str=None) -> list:
+        with self._lock:
+            return [o for o in self.orders.values() if o.active and (symbol is None or o.symbol == symbol)]
+
+    def wait(self, order: Order, timeout: float=None, acked: bool=False) -> bool:
+        """
+        Block until the order is filled, cancelled or rejected (or with
+        acked=True, until it was accepted or rejected). For scripts; the bots
+        should not need it.
+        """
+        return (order.acked if acked else order.done).wait(timeout)
+
+    # websocket and reconciliation
+
+    def connect(self, testnet: bool=False, api_key: str=None, api_secret: str=None):
+        """Subscribe to the private order and execution streams."""
+        from pybit.unified_trading import WebSocket
+        self.ws = WebSocket(testnet=testnet, channel_type="private", api_key=api_key, api_secret=api_secret)
+        self.ws.order_stream(callback=self.on_order_message)
+        self.ws.execution_stream(callback=self.on_execution_message)
+        return self.ws
+
+    def _lookup(self, order: Order):
+        """Refresh one order from REST; an order the exchange does not know about was never placed."""
+        kwargs = {"category": order.category, "symbol": order.symbol}
+        if order.order_id:
+            kwargs["orderId"] = order.order_id
+        else:
+            kwargs["orderLinkId"] = order.link_id
+        try:
+            rows = self.session.get_open_orders(**kwargs)["result"]["list"]
+            if not rows:
+                rows = self.session.get_order_history(**kwargs)["result"]["list"]
+        except Exception as e:
+            logging.error("Lookup of order %s failed: %s", order.link_id, e)
+            return
+        if rows:
+            self.apply_order(rows[0])
+            order.updated = time.time()
+        elif time.time() - order.created > self.stale_after:
+            self._reject(order, "not found on the exchange", inferred=True)
+
+    def reconcile(self):
+        """Look up orders that have had no update for stale_after seconds."""
+        now = time.time()
+        for order in self.open_orders():
+            if now - order.updated > self.stale_after:
+                self._lookup(order)
+
+    def _run(self):
+        while not self._stop.wait(self.reconcile_interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logging.error("Exception in order reconcile: %s", e)
+
+    def start(self):
+        """Reconcile stale orders in a daemon thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="orders", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.ws is not None:
+            self.ws.exit()
+            self.ws = None
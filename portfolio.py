@@ -0,0 +1,141 @@
+# portfolio.py
+"""
+Portfolio backtest of the main-bot.py strategy over several symbols with
+shared capital.
+
+All symbols are aligned on one timestamp grid as a (time x symbol) matrix.
+Indicators and signals are computed for every column at once, so another
+symbol costs one more column of array work. Positions only change on candles
+where some symbol has a signal; only those candles are walked to size
+positions against the shared margin, and the equity curve is then marked to
+market for every candle in one pass.
+
+Usage: python portfolio.py SYMBOL.npz [SYMBOL.npz ...]
+"""
+import os
+import sys
+
+import numpy as np
+
+import backtest
+from history import load_history
+
+SYMBOLS = ['ADAUSDT', 'BTCUSDT', 'LINKUSDT', 'ARBUSDT']
+
+
+def align(histories: dict, fields=("close",)):
+    """
+    Align kline arrays of several symbols on the union of their timestamps.
+    Returns (symbols, open_time, matrices) where matrices maps each field to a
+    (time x symbol) array. Prices are forward filled; before a symbol's first
+    candle its column is NaN.
+    """
+    symbols = list(histories)
+    open_time = np.unique(np.concatenate([histories[s]["open_time"] for s in symbols]))
+    rows = np.arange(len(open_time))
+    matrices = {}
+    for field in fields:
+        m = np.full((len(open_time), len(symbols)), np.nan)
+        for j, s in enumerate(symbols):
+            m[np.searchsorted(open_time, histories[s]["open_time"]), j] = histories[s][field]
+        if field in ("volume", "turnover"):
+            matrices[field] = np.where(np.isnan(m), 0.0, m)
+            continue
+        # forward fill: index of the last valid row for every cell
+        last = np.where(~np.isnan(m), rows[:, None], 0)
+        np.maximum.accumulate(last, axis=0, out=last)
+        matrices[field] = m[last, np.arange(len(symbols))]
+    return symbols, open_time, matrices
+
+
+def simulate(close, signals, capital=10000.0, fraction=0.25, leverage=5.0, fee=0.00055):
+    """
+    Trade signals (see backtest.sma_rsi_signals) on a (time x symbol) close
+    matrix with one shared margin account, following main-bot.py: an opposite
+    signal closes the position, a signal with no position opens one.
+    Each new position uses `fraction` of current equity as margin at
+    `leverage`; it is skipped if the free margin is not enough.
+    Returns a dict with the equity curve, the position matrix and trade counts.
+    """
+    n_rows, n_symbols = close.shape
+    position = np.zeros(n_symbols)
+    entry = np.zeros(n_symbols)
+    cash = capital
+    trades = np.zeros(n_symbols, dtype=np.int64)
+    event_rows = np.flatnonzero((signals != 0).any(axis=1))
+    snapshots = np.zeros((len(event_rows), n_symbols))
+
+    for k, t in enumerate(event_rows):
+        price = close[t]
+        signal = signals[t]
+        tradable = ~np.isnan(price)
+        px = np.where(tradable, price, 0.0)
+        pnl = position * (px - entry)
+
+        to_close = tradable & (((signal == 1) & (position < 0)) | ((signal == -1) & (position > 0)))
+        if to_close.any():
+            cash += pnl[to_close].sum() - fee * np.abs(position[to_close] * px[to_close]).sum()
+            position[to_close] = 0.0
+            entry[to_close] = 0.0
+            pnl[to_close] = 0.0
+
+        to_open = tradable & (signal != 0) & (position == 0) & ~to_close
+        if to_open.any():
+            equity = cash + pnl.sum()
+            margin = equity * fraction
+            free = equity - np.abs(position * px).sum() / leverage
+            candidates = np.flatnonzero(to_open)
+            allowed = candidates[np.cumsum(np.full(len(candidates), margin)) <= free]
+            qty = margin * leverage / px[allowed]
+            position[allowed] = qty * signal[allowed]
+            entry[allowed] = px[allowed]
+            cash -= fee * (qty * px[allowed]).sum()
+            trades[allowed] += 1
+        snapshots[k] = position
+
+    # positions held over every candle, then mark to market in one pass
+    idx = np.searchsorted(event_rows, np.arange(n_rows), side="right") - 1
+    positions = np.where((idx >= 0)[:, None], snapshots[np.maximum(idx, 0)], 0.0)
+    price_change = np.nan_to_num(np.diff(close, axis=0))
+    pnl = np.zeros(n_rows)
+    pnl[1:] = (positions[:-1] * price_change).sum(axis=1)
+    traded = np.abs(np.diff(positions, axis=0, prepend=0.0)) * np.nan_to_num(close)
+    equity = capital + np.cumsum(pnl - fee * traded.sum(axis=1))
+    return {"equity": equity, "positions": positions, "trades": trades}
+
+
+def metrics(equity) -> dict:
+    """Summary statistics of an equity curve."""
+    returns = np.diff(equity) / equity[:-1]
+    peak = np.maximum.accumulate(equity)
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    return {
+        "total_return": float(equity[-1] / equity[0] - 1.0),
+        "max_drawdown": float(np.max(1.0 - equity / peak)),
+        "sharpe": float(returns.mean() / std * np.sqrt(len(returns))) if std > 0 else 0.0,
+    }
+
+
+def run(histories: dict, capital=10000.0, fraction=0.25, leverage=5.0, fee=0.00055, **strategy):
+    """Align the histories, generate signals for all symbols at once and simulate the portfolio."""
+    symbols, open_time, matrices = align(histories)
+    close = matrices["close"]
+    signals = backtest.sma_rsi_signals(close, **strategy)
+    result = simulate(close, signals, capital, fraction, leverage, fee)
+    result.update(symbols=symbols, open_time=open_time, metrics=metrics(result["equity"]))
+    return result
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Error: invalid arguments!!\nYou need one history file per symbol, e.g. BTCUSDT.npz")
+        quit()
+    histories = {os.path.splitext(os.path.basename(p))[0]: load_history(p) for p in sys.argv[1:]}
+    result = run(histories)
+    for symbol, n in zip(result["symbols"], result["trades"]):
+        print(f"{symbol}: {n} trades")
+    print(f"Portfolio: {result['metrics']}")
+
+
+if __name__ == '__main__':
+    main()
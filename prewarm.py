@@ -0,0 +1,147 @@
+# prewarm.py
+"""
+Pre-close phase: shortly before a candle closes, warm the pooled HTTPS
+connections and build every order the bot might send at the close, so that
+after the signal only the signature and the send are left.
+
+Orders are built for both sides, to open (the bot's quantity) and to close
+(the current position), with quantities rounded and checked against the
+instrument spec. Their JSON body and HTTP request are prepared in advance;
+send() adds the signed headers and posts. Each prepared order carries its
+own orderLinkId, so falling back to the normal session.place_order() after
+an error cannot place it twice.
+"""
+import logging
+import threading
+import time
+import uuid
+
+import requests
+from pybit._http_manager import _RetryableRequestError
+from pybit.exceptions import FailedRequestError
+from pybit.trade import Trade
+
+from hedging import HedgedSession
+from instruments import check_order, round_qty
+
+
+def _http(session):
+    """The pybit HTTP session under a HedgedSession."""
+    return session.session if isinstance(session, HedgedSession) else session
+
+
+def warm_connections(session, connections: int=2, timeout: float=2.0) -> float:
+    """
+    Open or refresh `connections` pooled keep-alive connections with a cheap
+    public request on each. Returns the time it took in ms.
+    """
+    http = _http(session)
+    url = f"{http.endpoint}/v5/market/time"
+    start = time.perf_counter()
+
+    def touch():
+        try:
+            http.client.get(url, timeout=timeout).close()
+        except requests.RequestException as e:
+            logging.warning("Connection warm-up failed: %s", e)
+
+    threads = [threading.Thread(target=touch) for _ in range(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (time.perf_counter() - start) * 1000
+
+
+class PreparedOrder:
+    """A place_order request built ahead of time. send() signs and posts it, once."""
+
+    def __init__(self, session, params: dict):
+        self.session = session
+        self.http = _http(session)
+        self.params = dict(params, orderLinkId=params.get("orderLinkId") or uuid.uuid4().hex)
+        self.payload = self.http.prepare_payload("POST", self.http._clean_query(dict(self.params)))
+        self.url = f"{self.http.endpoint}{Trade.PLACE_ORDER}"
+        self.request = self.http.client.prepare_request(requests.Request("POST", self.url, data=self.payload))
+        self.sent = False
+        self.latency_ms = None
+
+    @property
+    def qty(self) -> str:
+        return self.params["qty"]
+
+    def send(self):
+        if self.sent:
+            raise RuntimeError(f"Order {self.params['orderLinkId']} was already sent")
+        self.sent = True
+        http = self.http
+        start = time.perf_counter()
+        try:
+            self.request.headers.update(http._prepare_headers(self.payload, http.recv_window))
+            response = http.client.send(self.request, timeout=http.timeout)
+            http._check_status_code(response, "POST", self.url, self.payload)
+            result = http._handle_response(response, "POST", self.url, self.payload, http.recv_window, 0)
+        except (requests.RequestException, ValueError, _RetryableRequestError, FailedRequestError) as e:
+            # same orderLinkId, so the exchange rejects it if the first send got through
+            logging.warning("Prepared order failed (%s), sending through the session", e)
+            result = self.session.place_order(**self.params)
+        self.latency_ms = (time.perf_counter() - start) * 1000
+        return result
+
+
+class PreClose:
+    """Builds the open and close market orders of one symbol before every candle close."""
+
+    def __init__(self, session, instruments=None, connections: int=2, category: str="linear"):
+        self.session = session
+        self.instruments = instruments
+        self.connections = connections
+        self.category = category
+        self.orders = {}
+
+    def _order(self, symbol, side, qty, price, reduce_only):
+        if self.instruments is not None:
+            spec = self.instruments.get(symbol)
+            qty = round_qty(spec, qty)
+            reason = check_order(spec, qty, price, market=True) if price else None
+            if reason:
+                logging.warning("Not preparing %s %s %s: %s", side, qty, symbol, reason)
+                return None
+        params = {"category": self.category, "symbol": symbol, "side": side, "orderType": "Market",
+                  "qty": str(qty), "timeInForce": "IOC", "reduceOnly": reduce_only}
+        return PreparedOrder(self.session, params)
+
+    def prepare(self, symbol: str, qty, position_side: str=None, position_size=0.0, price: float=None) -> dict:
+        """
+        Orders keyed by (action, side): ('open', 'Buy'), ('open', 'Sell') and,
+        with an open position, the order that closes it, e.g. ('close', 'Sell').
+        """
+        orders = {}
+        for side in ("Buy", "Sell"):
+            orders[("open", side)] = self._order(symbol, side, qty, price, False)
+        if position_side and float(position_size) > 0:
+            side = "Sell" if position_side == "Buy" else "Buy"
+            orders[("close", side)] = self._order(symbol, side, abs(float(position_size)), price, True)
+        self.orders = {key: order for key, order in orders.items() if order is not None}
+        return self.orders
+
+    def run(self, symbol: str, qty, position_side: str=None, position_size=0.0, price: float=None) -> dict:
+        """Warm the connections and prepare the orders; call this shortly before the close."""
+        start = time.perf_counter()
+        warm_ms = warm_connections(self.session, self.connections)
+        orders = self.prepare(symbol, qty, position_side, position_size, price)
+        logging.info("Pre-close for %s: warm-up %.1f ms, %d orders ready in %.1f ms", symbol, warm_ms,
+                     len(orders), (time.perf_counter() - start) * 1000)
+        return orders
+
+    def take(self, action: str, side: str, qty=None):
+        """The prepared order for action and side, if it exists, is unsent and (when given) has this quantity."""
+        order = self.orders.pop((action, side), None)
+        if order is None or order.sent:
+            return None
+        if qty is not None:
+            if self.instruments is not None:
+                qty = round_qty(self.instruments.get(order.params["symbol"]), qty)
+            if float(order.qty) != float(qty):
+                return None
+        return order
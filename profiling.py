@@ -0,0 +1,258 @@
+# profiling.py
+"""
+Profiling mode for the bots, switched on with PROFILE=1.
+
+A sampler thread takes the Python stack of the profiled threads PROFILE_HZ
+times a second (100 by default, a few Hz is cheap enough to leave on). The
+code marks the stages of its loop (fetch_klines, indicators, signals,
+orders, ...) with stage() or instrument(), and every sample is filed under
+the stages the thread was in. Per stage it also adds up calls, wall time
+and CPU time, and with PROFILE_MEMORY=1 net_traced_bytes (tracemalloc, which
+slows Python down noticeably): the net change of the whole process's traced
+memory while the stage ran. tracemalloc does not know threads, so this
+includes what the risk, order and clock threads allocated or freed
+meanwhile, and it can be negative. It is not what the stage allocated; the
+mem.folded file shows where memory is held by stack.
+
+Every PROFILE_REPORT_S seconds and at exit it writes to PROFILE_DIR:
+
+    NAME-PID.cpu.folded    sampled stacks, collapsed format (flamegraph.pl, speedscope)
+    NAME-PID.mem.folded    live allocations in bytes by stack (PROFILE_MEMORY=1)
+    NAME-PID.stages.json   per stage totals
+
+Samples taken in the idle stage (sleeping until the next candle) are
+counted in the stage totals but left out of the flame graph.
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+IDLE = "idle"
+
+
+class StageStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.net_traced = 0
+        self.samples = 0
+
+
+def _frame_name(code) -> str:
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+class Profiler:
+
+    def __init__(self, name: str, path: str="profile", hz: float=100.0, memory: bool=False, memory_frames: int=16,
+                 report_interval: float=60.0):
+        self.name = name
+        self.path = path
+        self.hz = hz
+        self.memory = memory
+        self.memory_frames = memory_frames
+        self.report_interval = report_interval
+        self.prefix = os.path.join(path, f"{name}-{os.getpid()}")
+        self.stacks = {}  # collapsed stack -> samples
+        self.stats = {}  # stage path -> StageStats
+        self._stages = {}  # thread id -> list of stage names
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._here = os.path.abspath(__file__)
+        self.started = None
+        self.sample_time = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+        self._threads.add(threading.main_thread().ident)
+        self.started = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        logging.info("Profiling at %s Hz%s, reports in %s.*", self.hz, " with tracemalloc" if self.memory else "",
+                     self.prefix)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.write()
+        atexit.unregister(self.stop)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Marks the code in the block as stage `name`, nested inside the current
+        stage of the thread. CPU time is the thread's own; net_traced_bytes
+        is process-wide (see the module docstring).
+        """
+        ident = threading.get_ident()
+        stack = self._stages.get(ident)
+        if stack is None:
+            stack = self._stages[ident] = []
+            self._threads.add(ident)
+        stack.append(name)
+        key = ";".join(stack)
+        traced = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            cpu, wall = time.thread_time() - cpu, time.perf_counter() - wall
+            if self.memory:
+                traced = tracemalloc.get_traced_memory()[0] - traced
+            stack.pop()
+            with self._lock:
+                stats = self.stats.get(key)
+                if stats is None:
+                    stats = self.stats[key] = StageStats()
+                stats.calls += 1
+                stats.wall += wall
+                stats.cpu += cpu
+                stats.net_traced += traced
+
+    def instrument(self, namespace, *names, prefix: str=""):
+        """
+        Run every call of the functions `names` of a module's globals() or of
+        an object (e.g. a session) in a stage named prefix + function name.
+        """
+        is_dict = isinstance(namespace, dict)
+        for name in names:
+            fn = namespace[name] if is_dict else getattr(namespace, name)
+            wrapper = self._staged(fn, prefix + name)
+            if is_dict:
+                namespace[name] = wrapper
+            else:
+                setattr(namespace, name, wrapper)
+
+    def _staged(self, fn, stage):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident in list(self._threads):
+            frame = frames.get(ident)
+            if frame is None:
+                self._threads.discard(ident)
+                self._stages.pop(ident, None)
+                continue
+            stages = list(self._stages.get(ident) or ())
+            names = []
+            while frame is not None:
+                if frame.f_code.co_filename != self._here:
+                    names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            names.reverse()
+            with self._lock:
+                if stages:
+                    stats = self.stats.get(";".join(stages))
+                    if stats is not None:
+                        stats.samples += 1
+                if stages and stages[-1] == IDLE:
+                    continue
+                key = ";".join([f"[{s}]" for s in stages] + names)
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def _run(self):
+        period = 1.0 / self.hz
+        next_report = time.monotonic() + self.report_interval
+        while not self._stop.wait(period):
+            start = time.perf_counter()
+            self._sample()
+            self.sample_time += time.perf_counter() - start
+            if time.monotonic() >= next_report:
+                next_report += self.report_interval
+                self.write()
+
+    def report(self) -> dict:
+        """Per stage totals, and what the sampling itself cost."""
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        with self._lock:
+            stages = {key: {"calls": s.calls, "wall_s": s.wall, "cpu_s": s.cpu, "net_traced_bytes": s.net_traced,
+                            "samples": s.samples} for key, s in self.stats.items()}
+        return {"name": self.name, "pid": os.getpid(), "elapsed_s": elapsed, "hz": self.hz,
+                "sampler_overhead": self.sample_time / elapsed if elapsed else 0.0, "stages": stages}
+
+    def _write_file(self, path, text):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def write(self):
+        """Write the flame graph files and stage totals, and log the stages."""
+        try:
+            with self._lock:
+                folded = "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+            self._write_file(self.prefix + ".cpu.folded", folded)
+            if self.memory and tracemalloc.is_tracing():
+                self._write_file(self.prefix + ".mem.folded", _memory_folded(tracemalloc.take_snapshot()))
+            report = self.report()
+            self._write_file(self.prefix + ".stages.json", json.dumps(report, indent=2))
+        except OSError as e:
+            logging.error("Could not write profile %s: %s", self.prefix, e)
+            return
+        for key, s in sorted(report["stages"].items(), key=lambda item: -item[1]["wall_s"]):
+            logging.info("Stage %-40s %6d calls %9.3f s wall %9.3f s cpu %+11d net traced bytes", key, s["calls"],
+                         s["wall_s"], s["cpu_s"], s["net_traced_bytes"])
+
+
+def _memory_folded(snapshot) -> str:
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    lines = {}
+    for stat in snapshot.statistics("traceback"):
+        key = ";".join(f"{os.path.basename(frame.filename)}:{frame.lineno}" for frame in stat.traceback)
+        lines[key] = lines.get(key, 0) + stat.size
+    return "".join(f"{key} {size}\n" for key, size in sorted(lines.items()))
+
+
+class NullProfiler:
+    """Stands in for Profiler when profiling is off."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def write(self):
+        pass
+
+    def stage(self, name: str):
+        return nullcontext()
+
+    def instrument(self, namespace, *names, prefix: str=""):
+        pass
+
+
+def from_env(name: str):
+    """A started Profiler when PROFILE=1, a NullProfiler otherwise."""
+    if os.getenv("PROFILE") != "1":
+        return NullProfiler()
+    profiler = Profiler(name, path=os.getenv("PROFILE_DIR", "profile"), hz=float(os.getenv("PROFILE_HZ", "100")),
+                        memory=os.getenv("PROFILE_MEMORY") == "1",
+                        report_interval=float(os.getenv("PROFILE_REPORT_S", "60")))
+    profiler.start()
+    return profiler
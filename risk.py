@@ -0,0 +1,183 @@
+# risk.py
+import logging
+import threading
+import time
+from collections import deque
+
+from utils import get_total_ballance
+
+
+def _add_position(positions: dict, symbol: str, signed: float):
+    size = positions.get(symbol, 0.0) + signed
+    if abs(size) < 1e-12:
+        positions.pop(symbol, None)
+    else:
+        positions[symbol] = size
+
+
+class RiskEngine:
+    """
+    Pre-trade risk checks kept entirely in memory.
+    Every order goes through check_order() before it is sent; the check only
+    touches local dicts, so it costs microseconds and never hits the network.
+    Equity and positions are refreshed in a background thread and moved by
+    fills (on_fill), not by accepting an order, which may still fail.
+
+    Reduce-only orders can only shrink exposure, so they are never rate
+    limited and are only refused when fresh position data shows they would
+    add to the position; the bot can always get flat.
+    """
+
+    def __init__(self, max_leverage=20, max_symbol_notional=5000.0, max_gross_notional=20000.0,
+                 max_account_leverage=5.0, max_orders_per_sec=5, max_symbol_orders_per_sec=2,
+                 refresh_interval=10.0):
+        self.max_leverage = float(max_leverage)
+        self.max_symbol_notional = float(max_symbol_notional)
+        self.max_gross_notional = float(max_gross_notional)
+        self.max_account_leverage = float(max_account_leverage)
+        self.max_orders_per_sec = max_orders_per_sec
+        self.max_symbol_orders_per_sec = max_symbol_orders_per_sec
+        self.refresh_interval = refresh_interval
+
+        self.equity = None          # total equity in USD, None until the first refresh
+        self.equity_updated = 0.0
+        self.positions = {}         # symbol -> signed size (positive long, negative short)
+        self.positions_updated = None  # time.time() of the last refresh, None until the first
+        self.prices = {}            # symbol -> last known price
+        self._pending_fills = None  # (symbol, signed qty) of fills since the running refresh started
+        self._orders = deque()      # send times of accepted orders (monotonic seconds)
+        self._symbol_orders = {}    # symbol -> deque of send times
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def update_price(self, symbol: str, price: float):
+        """Record the latest price of a symbol, used for market orders without a price."""
+        self.prices[symbol] = float(price)
+
+    def gross_notional(self) -> float:
+        """Sum of absolute position notionals across all symbols."""
+        return sum(abs(size) * self.prices.get(s, 0.0) for s, size in self.positions.items())
+
+    def positions_fresh(self) -> bool:
+        """True if the positions were refreshed within the last few refresh intervals."""
+        return self.positions_updated is not None and time.time() - self.positions_updated < 3 * self.refresh_interval
+
+    def check_order(self, symbol: str, side: str, qty, price=None, lev=None, reduce_only: bool=False):
+        """
+        Check an order against all limits.
+        Returns None if the order is allowed, otherwise a string with the reason.
+        """
+        now = time.monotonic()
+        qty = float(qty)
+        if qty <= 0:
+            return f"invalid quantity {qty}"
+        if lev is not None and float(lev) > self.max_leverage:
+            return f"leverage {lev} above limit {self.max_leverage:g}"
+
+        with self._lock:
+            if reduce_only:
+                current = self.positions.get(symbol, 0.0)
+                signed = qty if side == "Buy" else -qty
+                if self.positions_fresh() and signed * current > 0:
+                    return f"reduce-only order would increase {symbol} position"
+                return None
+            if price is None:
+                price = self.prices.get(symbol)
+                if price is None:
+                    return f"no price known for {symbol}"
+            price = float(price)
+
+            orders = self._orders
+            while orders and now - orders[0] > 1.0:
+                orders.popleft()
+            if len(orders) >= self.max_orders_per_sec:
+                return "order rate limit reached"
+            symbol_orders = self._symbol_orders.setdefault(symbol, deque())
+            while symbol_orders and now - symbol_orders[0] > 1.0:
+                symbol_orders.popleft()
+            if len(symbol_orders) >= self.max_symbol_orders_per_sec:
+                return f"order rate limit reached for {symbol}"
+
+            current = self.positions.get(symbol, 0.0)
+            signed = qty if side == "Buy" else -qty
+            after = current + signed
+            symbol_notional = abs(after) * price
+            if symbol_notional > self.max_symbol_notional and abs(after) > abs(current):
+                return f"{symbol} notional {symbol_notional:.2f} above limit {self.max_symbol_notional:g}"
+            old_price = self.prices.get(symbol, price)
+            gross = self.gross_notional() - abs(current) * old_price + abs(after) * price
+            if gross > self.max_gross_notional and abs(after) > abs(current):
+                return f"gross notional {gross:.2f} above limit {self.max_gross_notional:g}"
+            if self.equity and gross / self.equity > self.max_account_leverage and abs(after) > abs(current):
+                return f"account leverage {gross / self.equity:.2f} above limit {self.max_account_leverage:g}"
+
+            orders.append(now)
+            symbol_orders.append(now)
+        return None
+
+    def on_fill(self, symbol: str, side: str, qty, price=None):
+        """Apply a fill to the local position book."""
+        signed = float(qty) if side == "Buy" else -float(qty)
+        with self._lock:
+            _add_position(self.positions, symbol, signed)
+            if self._pending_fills is not None:
+                self._pending_fills.append((symbol, signed))
+            if price:
+                self.prices[symbol] = float(price)
+
+    def refresh(self, session):
+        """
+        Refresh equity and positions from the exchange. Fills that arrive
+        while the request is in flight may be missing from the snapshot, so
+        they are applied again on top of it; one that the snapshot already
+        holds is then counted twice until the next refresh, which errs on the
+        side of a larger position.
+        """
+        with self._lock:
+            self._pending_fills = []
+        try:
+            balance = get_total_ballance(session)
+            res = session.get_positions(category="linear", settleCoin="USDT")
+        except Exception:
+            with self._lock:
+                self._pending_fills = None
+            raise
+        positions = {}
+        prices = {}
+        for pos in res["result"]["list"]:
+            size = float(pos["size"] or 0)
+            if size == 0:
+                continue
+            positions[pos["symbol"]] = size if pos["side"] == "Buy" else -size
+            if pos.get("markPrice"):
+                prices[pos["symbol"]] = float(pos["markPrice"])
+        with self._lock:
+            for symbol, signed in self._pending_fills or ():
+                _add_position(positions, symbol, signed)
+            self._pending_fills = None
+            self.equity = float(balance["totalEquity"])
+            self.equity_updated = time.time()
+            self.positions = positions
+            self.positions_updated = self.equity_updated
+            self.prices.update(prices)
+
+    def start(self, session):
+        """Start refreshing equity and positions in the background."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(session,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, session):
+        while not self._stop.is_set():
+            try:
+                self.refresh(session)
+            except Exception as e:
+                logging.error("Exception in risk refresh: %s", e)
+            self._stop.wait(self.refresh_interval)
@@ -0,0 +1,130 @@
+# robustness.py
+"""
+Monte Carlo robustness analysis of backtest results.
+
+A trade list (signal tuples from generate_signals()) or a plain return
+series is resampled many times and the distributions of max drawdown,
+final equity and Sharpe ratio are computed. Resamples are generated and
+evaluated as 2-D arrays, a chunk of rows at a time, so memory stays bounded.
+
+Usage: python robustness.py HISTORY.npz [RESAMPLES]
+"""
+import sys
+
+import numpy as np
+
+import backtest
+from history import load_history
+
+METHODS = ("bootstrap", "block", "shuffle")
+
+# Max number of resampled returns held in memory at once
+_CHUNK = 1 << 18
+
+
+def _as_returns(trades):
+    if len(trades) and isinstance(trades[0], tuple):
+        return backtest.trade_returns(trades)
+    return np.asarray(trades, dtype=np.float64)
+
+
+def _indices(n, rows, method, block_size, rng):
+    if method == "bootstrap":
+        return rng.integers(0, n, size=(rows, n))
+    size = min(block_size, n)
+    blocks = -(-n // size)
+    starts = rng.integers(0, n - size + 1, size=(rows, blocks))
+    return (starts[:, :, None] + np.arange(size)).reshape(rows, -1)[:, :n]
+
+
+def _drawdown(log_returns):
+    """Max drawdown of every row of log returns."""
+    log_equity = np.cumsum(log_returns, axis=1)
+    peak = np.maximum.accumulate(log_equity, axis=1)
+    np.maximum(peak, 0.0, out=peak)
+    np.subtract(log_equity, peak, out=peak)
+    return 1.0 - np.exp(peak.min(axis=1).astype(np.float64))
+
+
+def _sharpe(samples):
+    n = samples.shape[-1]
+    s1 = samples.sum(axis=-1)
+    var = (np.einsum("...i,...i->...", samples, samples) - s1 * s1 / n) / (n - 1)
+    std = np.sqrt(np.maximum(var, 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(std > 0, s1 / n / std * np.sqrt(n), 0.0)
+
+
+def simulate(trades, resamples=10000, method="bootstrap", block_size=10, seed=None):
+    """
+    Resample a trade list or return series `resamples` times.
+    method: "bootstrap" (i.i.d. draws with replacement), "block" (moving block
+    bootstrap, keeps short-range dependence) or "shuffle" (same trades in random order).
+    Returns a dict of arrays: max_drawdown, final_equity and sharpe.
+    """
+    returns = _as_returns(trades)
+    n = len(returns)
+    if n < 2:
+        raise ValueError("At least two trades are required")
+    if method not in METHODS:
+        raise ValueError("Unsupported resampling method")
+    rng = np.random.default_rng(seed)
+    out = {
+        "max_drawdown": np.empty(resamples),
+        "final_equity": np.empty(resamples),
+        "sharpe": np.empty(resamples),
+    }
+    log_returns = np.log1p(returns).astype(np.float32)
+    if method == "shuffle":
+        # Reordering trades changes the path but not the final equity or Sharpe ratio
+        out["final_equity"][:] = np.exp(np.log1p(returns).sum())
+        out["sharpe"][:] = _sharpe(returns)
+    rows = max(1, _CHUNK // n)
+    for start in range(0, resamples, rows):
+        stop = min(start + rows, resamples)
+        if method == "shuffle":
+            samples = rng.permuted(np.broadcast_to(log_returns, (stop - start, n)), axis=1)
+            out["max_drawdown"][start:stop] = _drawdown(samples)
+            continue
+        idx = _indices(n, stop - start, method, block_size, rng)
+        samples = log_returns[idx]
+        out["max_drawdown"][start:stop] = _drawdown(samples)
+        out["final_equity"][start:stop] = np.exp(samples.sum(axis=1, dtype=np.float64))
+        out["sharpe"][start:stop] = _sharpe(returns[idx])
+    return out
+
+
+def summary(distribution, percentiles=(5, 25, 50, 75, 95)) -> dict:
+    """Percentiles of every distribution returned by simulate()."""
+    return {name: dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+            for name, values in distribution.items()}
+
+
+def analyze(trades, resamples=10000, block_size=10, seed=None) -> dict:
+    """Run every resampling method and summarize the results, next to the original metrics."""
+    returns = _as_returns(trades)
+    report = {"original": backtest.metrics(returns)}
+    for method in METHODS:
+        dist = simulate(returns, resamples, method, block_size, seed)
+        report[method] = summary(dist)
+        report[method]["prob_loss"] = float((dist["final_equity"] < 1.0).mean())
+    return report
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Error: invalid arguments!!\nYou need HISTORY [RESAMPLES]")
+        quit()
+    data = load_history(sys.argv[1])
+    resamples = int(sys.argv[2]) if len(sys.argv) == 3 else 10000
+    signals, _ = backtest.run_bollinger(data)
+    report = analyze(signals, resamples)
+    print(f"Original: {report['original']}")
+    for method in METHODS:
+        print(f"{method}:")
+        for name, values in report[method].items():
+            print(f"  {name}: {values}")
+
+
+if __name__ == '__main__':
+    main()
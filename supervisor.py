@@ -0,0 +1,254 @@
+# supervisor.py
+"""
+Run the strategy for many symbols across several worker processes.
+
+Symbols are sharded over N workers with a consistent hash ring, so adding a
+symbol (or a worker) only moves the symbols whose position on the ring
+changes owner. Each worker fetches klines, computes indicators and signals
+for its symbols in a loop and reports health and latency stats back. The
+supervisor restarts workers that crash or stop sending heartbeats.
+
+Usage: python supervisor.py WORKERS TIMEFRAME SYMBOL [SYMBOL ...]
+"""
+import bisect
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+
+import numpy as np
+
+import backtest
+from klines import parse_kline_response
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+
+class HashRing:
+    """Consistent hash ring with `replicas` virtual nodes per worker."""
+
+    def __init__(self, nodes=(), replicas=100):
+        self.replicas = replicas
+        self._keys = []
+        self._nodes = []
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def add(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            idx = bisect.bisect(self._keys, h)
+            self._keys.insert(idx, h)
+            self._nodes.insert(idx, node)
+
+    def remove(self, node):
+        keep = [(k, n) for k, n in zip(self._keys, self._nodes) if n != node]
+        self._keys = [k for k, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def node_for(self, key: str):
+        if not self._keys:
+            raise ValueError("Hash ring is empty")
+        idx = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._nodes[idx]
+
+
+def public_session():
+    """Unauthenticated session; klines are public data."""
+    from pybit.unified_trading import HTTP
+    return HTTP(testnet=False)
+
+
+def evaluate_symbol(session, symbol, timeframe):
+    """Fetch klines for a symbol and return the main-bot.py signal of the last candle ('long', 'short' or None)."""
+    data = parse_kline_response(session.get_kline(category="linear", symbol=symbol, interval=timeframe, limit=200))
+    signal = backtest.sma_rsi_signals(data["close"])[-1] if len(data["close"]) else 0
+    return {1: 'long', -1: 'short'}.get(int(signal))
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def worker_main(worker_id, commands, stats, timeframe, interval, session_factory, evaluate):
+    """Worker process loop: evaluate every assigned symbol once per `interval` seconds."""
+    session = session_factory()
+    symbols = []
+    cycles = 0
+    errors = 0
+    while True:
+        try:
+            while True:
+                cmd, arg = commands.get_nowait()
+                if cmd == "stop":
+                    return
+                if cmd == "assign":
+                    symbols = list(arg)
+        except queue.Empty:
+            pass
+
+        start = time.monotonic()
+        latencies = []
+        signals = {}
+        for symbol in symbols:
+            t = time.perf_counter()
+            try:
+                signals[symbol] = evaluate(session, symbol, timeframe)
+            except Exception as e:
+                errors += 1
+                logging.error("Worker %s: exception evaluating %s: %s", worker_id, symbol, e)
+            latencies.append((time.perf_counter() - t) * 1000)
+        cycles += 1
+        stats.put({
+            "worker": worker_id,
+            "pid": os.getpid(),
+            "time": time.time(),
+            "symbols": len(symbols),
+            "cycles": cycles,
+            "errors": errors,
+            "cycle_ms": (time.monotonic() - start) * 1000,
+            "p50_ms": _percentile(latencies, 50),
+            "p99_ms": _percentile(latencies, 99),
+            "signals": signals,
+        })
+        # wait for the next cycle, but pick up new assignments right away
+        remaining = interval - (time.monotonic() - start)
+        if remaining > 0:
+            try:
+                cmd, arg = commands.get(timeout=remaining)
+                if cmd == "stop":
+                    return
+                if cmd == "assign":
+                    symbols = list(arg)
+            except queue.Empty:
+                pass
+
+
+class Supervisor:
+    """Starts, shards and restarts strategy worker processes."""
+
+    def __init__(self, workers: int, timeframe: str, interval: float=60.0, heartbeat_timeout: float=None,
+                 session_factory=public_session, evaluate=evaluate_symbol):
+        self.timeframe = timeframe
+        self.interval = interval
+        self.heartbeat_timeout = heartbeat_timeout or max(3 * interval, 30.0)
+        self.session_factory = session_factory
+        self.evaluate = evaluate
+        self.ring = HashRing(range(workers))
+        self.symbols = set()
+        self.assignment = {w: [] for w in range(workers)}
+        self.procs = {}
+        self.commands = {}
+        self.stats = mp.Queue()
+        self.health = {}
+        self.restarts = {w: 0 for w in range(workers)}
+
+    def _start_worker(self, w):
+        self.commands[w] = mp.Queue()
+        self.commands[w].put(("assign", self.assignment[w]))
+        proc = mp.Process(target=worker_main, name=f"strategy-worker-{w}", daemon=True,
+                          args=(w, self.commands[w], self.stats, self.timeframe, self.interval,
+                                self.session_factory, self.evaluate))
+        proc.start()
+        self.procs[w] = proc
+        self.health[w] = {"worker": w, "pid": proc.pid, "time": time.time(), "symbols": len(self.assignment[w])}
+
+    def start(self):
+        for w in self.assignment:
+            self._start_worker(w)
+
+    def _rebalance(self):
+        assignment = {w: [] for w in self.assignment}
+        for symbol in sorted(self.symbols):
+            assignment[self.ring.node_for(symbol)].append(symbol)
+        for w, symbols in assignment.items():
+            if symbols != self.assignment.get(w) and w in self.commands:
+                self.commands[w].put(("assign", symbols))
+        self.assignment = assignment
+
+    def add_symbols(self, symbols):
+        self.symbols.update(symbols)
+        self._rebalance()
+
+    def remove_symbols(self, symbols):
+        self.symbols.difference_update(symbols)
+        self._rebalance()
+
+    def add_worker(self):
+        """Add one worker process and move its share of symbols to it."""
+        w = max(self.assignment) + 1 if self.assignment else 0
+        self.ring.add(w)
+        self.assignment[w] = []
+        self.restarts[w] = 0
+        self._rebalance()
+        self._start_worker(w)
+
+    def poll(self):
+        """Collect stats and restart workers that died or went silent. Call this periodically."""
+        while True:
+            try:
+                s = self.stats.get_nowait()
+            except queue.Empty:
+                break
+            self.health[s["worker"]] = s
+        now = time.time()
+        for w, proc in list(self.procs.items()):
+            silent = now - self.health.get(w, {}).get("time", now) > self.heartbeat_timeout
+            if not proc.is_alive() or silent:
+                logging.error("Worker %s %s, restarting", w, "is not responding" if proc.is_alive() else "died")
+                if proc.is_alive():
+                    proc.terminate()
+                proc.join(timeout=5)
+                self.restarts[w] += 1
+                self._start_worker(w)
+
+    def report(self) -> dict:
+        """Health of all workers plus totals."""
+        workers = {w: dict(h, restarts=self.restarts.get(w, 0), alive=self.procs[w].is_alive())
+                   for w, h in self.health.items() if w in self.procs}
+        p99 = [h["p99_ms"] for h in workers.values() if h.get("p99_ms") is not None]
+        return {
+            "workers": workers,
+            "symbols": len(self.symbols),
+            "restarts": sum(self.restarts.values()),
+            "max_p99_ms": max(p99) if p99 else None,
+        }
+
+    def stop(self):
+        for w, q in self.commands.items():
+            q.put(("stop", None))
+        for proc in self.procs.values():
+            proc.join(timeout=self.interval + 5)
+            if proc.is_alive():
+                proc.terminate()
+
+
+def main():
+    if len(sys.argv) < 4:
+        print("Error: invalid arguments!!\nYou need WORKERS TIMEFRAME SYMBOL [SYMBOL ...]")
+        quit()
+    timeframe = sys.argv[2]
+    supervisor = Supervisor(int(sys.argv[1]), timeframe, interval=60 if timeframe == "1" else 300)
+    supervisor.add_symbols(sys.argv[3:])
+    supervisor.start()
+    try:
+        while True:
+            time.sleep(5)
+            supervisor.poll()
+            report = supervisor.report()
+            for w, h in sorted(report["workers"].items()):
+                logging.info("Worker %s: pid=%s symbols=%s cycles=%s p99=%sms restarts=%s",
+                             w, h.get("pid"), h.get("symbols"), h.get("cycles"), h.get("p99_ms"), h["restarts"])
+    except KeyboardInterrupt:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
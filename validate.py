@@ -0,0 +1,165 @@
+# validate.py
+"""
+Quality checks for kline arrays (dicts keyed by KLINE_COLUMNS), on whole
+arrays at once: order, duplicate and missing candles, misaligned open times,
+NaN values, OHLC consistency (low <= open/close <= high) and zero volume.
+Zero volume is only informational: quiet markets and the forming candle
+have it, so it does not make a report fail.
+
+repair() sorts and deduplicates, then refetches only the time ranges that
+are missing or hold bad candles and merges them in.
+
+Usage: python validate.py HISTORY.npz INTERVAL [SYMBOL]
+    with SYMBOL the defects are repaired from the API and the file is rewritten
+"""
+import logging
+import sys
+
+import numpy as np
+
+import history
+from klines import KLINE_COLUMNS
+
+INTERVAL_MS = {
+    "1": 60_000, "3": 180_000, "5": 300_000, "15": 900_000, "30": 1_800_000,
+    "60": 3_600_000, "120": 7_200_000, "240": 14_400_000, "360": 21_600_000, "720": 43_200_000,
+    "D": 86_400_000, "W": 604_800_000,
+}
+
+# Weekly candles open on Monday 00:00 UTC, the epoch was a Thursday
+ALIGN_OFFSET_MS = {INTERVAL_MS["W"]: 4 * 86_400_000}
+
+CHECKS = ("unordered", "duplicates", "gaps", "misaligned", "nan", "ohlc", "zero_volume")
+
+
+def interval_ms(interval) -> int:
+    """Candle length in ms of a Bybit interval ('1', '15', 'D', ...). Monthly candles have no fixed length."""
+    try:
+        return INTERVAL_MS[str(interval)]
+    except KeyError:
+        raise ValueError(f"Unsupported interval {interval}")
+
+
+def validate(data: dict, step_ms: int) -> dict:
+    """
+    Check kline arrays. Returns a report with, for every check, the indices of
+    the offending rows; for 'gaps' the indices of the candles after each gap.
+    'missing' is the number of candles missing in the gaps and 'ok' is True
+    if no check but zero_volume found anything.
+    """
+    t = np.asarray(data["open_time"], dtype=np.int64)
+    o, h, l, c, v = (np.asarray(data[name], dtype=np.float64) for name in ("open", "high", "low", "close", "volume"))
+    dt = np.diff(t)
+    nan = np.isnan(o) | np.isnan(h) | np.isnan(l) | np.isnan(c) | np.isnan(v)
+    body_low = np.minimum(o, c)
+    body_high = np.maximum(o, c)
+    ohlc = ~nan & ((l > body_low) | (h < body_high))
+    gaps = np.flatnonzero(dt > step_ms) + 1
+    report = {
+        "rows": len(t),
+        "unordered": np.flatnonzero(dt < 0) + 1,
+        "duplicates": np.flatnonzero(dt == 0) + 1,
+        "gaps": gaps,
+        "missing": int((dt[gaps - 1] // step_ms - 1).sum()) if len(gaps) else 0,
+        "misaligned": np.flatnonzero((t - ALIGN_OFFSET_MS.get(step_ms, 0)) % step_ms),
+        "nan": np.flatnonzero(nan),
+        "ohlc": np.flatnonzero(ohlc),
+        "zero_volume": np.flatnonzero(v == 0),
+    }
+    report["ok"] = not any(len(report[name]) for name in CHECKS if name != "zero_volume")
+    return report
+
+
+def summary(report: dict) -> str:
+    parts = [f"{report['rows']} rows"]
+    for name in CHECKS:
+        if len(report[name]):
+            parts.append(f"{name}={len(report[name])}")
+    if report["missing"]:
+        parts.append(f"missing_candles={report['missing']}")
+    if report.get("refetched"):
+        parts.append(f"refetched_ranges={len(report['refetched'])}")
+    if report["ok"]:
+        parts.append("ok")
+    return ", ".join(parts)
+
+
+def _sorted_unique(data: dict) -> dict:
+    """Sort by open_time; of duplicate candles the one that comes last wins."""
+    t = np.asarray(data["open_time"], dtype=np.int64)
+    order = np.argsort(t, kind="stable")
+    t = t[order]
+    keep = order[np.append(t[1:] != t[:-1], True)]
+    return {name: np.asarray(data[name])[keep] for name in KLINE_COLUMNS}
+
+
+def _ranges(t, report, step_ms, zero_volume):
+    """(start_ms, end_ms) ranges to refetch, merged when they touch."""
+    bad = [report["nan"], report["ohlc"]]
+    if zero_volume:
+        bad.append(report["zero_volume"])
+    bad = np.unique(np.concatenate(bad)).astype(np.int64)
+    gaps = report["gaps"]
+    starts = np.concatenate([t[bad], t[gaps - 1] + step_ms])
+    ends = np.concatenate([t[bad], t[gaps] - step_ms])
+    if not len(starts):
+        return []
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    # a new range begins where it does not continue the previous one
+    reach = np.maximum.accumulate(ends)
+    new = np.append(True, starts[1:] > reach[:-1] + step_ms)
+    first = np.flatnonzero(new)
+    last = np.append(first[1:] - 1, len(starts) - 1)
+    return list(zip(starts[first].tolist(), reach[last].tolist()))
+
+
+def repair(data: dict, step_ms: int, fetch, zero_volume: bool=False):
+    """
+    Sort, deduplicate and refetch missing and bad candles with fetch(start_ms, end_ms),
+    which returns kline arrays for that inclusive range. Zero volume candles are
+    refetched too with zero_volume=True. Returns (data, report) after the repair.
+    """
+    data = _sorted_unique(data)
+    report = validate(data, step_ms)
+    ranges = _ranges(data["open_time"], report, step_ms, zero_volume)
+    if ranges:
+        bad = np.concatenate([report["nan"], report["ohlc"]]).astype(np.int64)
+        keep = np.ones(report["rows"], dtype=bool)
+        keep[bad] = False
+        parts = [{name: data[name][keep] for name in KLINE_COLUMNS}]
+        for start, end in ranges:
+            try:
+                parts.append(fetch(start, end))
+            except Exception as e:
+                logging.error("Refetching klines %s - %s failed: %s", start, end, e)
+        merged = {name: np.concatenate([np.asarray(p[name]) for p in parts]) for name in KLINE_COLUMNS}
+        data = _sorted_unique(merged)
+        report = validate(data, step_ms)
+    report["refetched"] = ranges
+    return data, report
+
+
+def session_fetcher(session, symbol, interval, category="linear"):
+    """fetch(start_ms, end_ms) for repair() that calls the API through history.fetch_history()."""
+    return lambda start, end: history.fetch_history(session, symbol, interval, start, end, category)
+
+
+def main():
+    if len(sys.argv) not in (3, 4):
+        print("Error: invalid arguments!!\nYou need HISTORY.npz INTERVAL [SYMBOL]")
+        quit()
+    path, interval = sys.argv[1], sys.argv[2]
+    data = history.load_history(path)
+    report = validate(data, interval_ms(interval))
+    print(summary(report))
+    if len(sys.argv) == 4 and not report["ok"]:
+        from pybit.unified_trading import HTTP
+        fetch = session_fetcher(HTTP(testnet=False), sys.argv[3], interval)
+        data, report = repair(data, interval_ms(interval), fetch)
+        history.save_history(path, data)
+        print("After repair:", summary(report))
+
+
+if __name__ == '__main__':
+    main()
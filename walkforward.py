@@ -0,0 +1,133 @@
+# walkforward.py
+"""
+Walk-forward validation of the Bollinger Band strategy.
+
+History is split into consecutive train/test folds. For every fold the
+parameters are optimized on the train window and then evaluated on the test
+window that follows it. Folds run in parallel worker processes.
+
+Each worker computes the bands once per parameter set over the full history
+and every fold slices them, instead of recomputing them per (overlapping)
+window. This is deliberate: a fold sees bands warmed up on all the history
+before it, as a live bot running since then would. It is not the same as
+recomputing on each window; windowed bands (SMA, WMA, VWMA, deviation) match
+after their first `length` candles, but EMA / RMA depend on where they were
+seeded and differ.
+
+Usage: python walkforward.py HISTORY.npz TRAIN_BARS TEST_BARS [WORKERS]
+"""
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+import backtest
+import indicators
+from history import load_history
+
+PARAM_GRID = {
+    "length": [10, 20, 30, 50],
+    "ma_type": list(indicators.MA_TYPES),
+    "mult": [1.5, 2.0, 2.5, 3.0],
+}
+
+_data = None
+
+
+def make_folds(n, train, test, step=None, anchored=False):
+    """
+    Split n bars into folds of (train_start, train_end, test_start, test_end) indices,
+    end exclusive. Rolling windows by default; anchored folds always train from bar 0.
+    """
+    step = step or test
+    folds = []
+    start = 0
+    while start + train + test <= n:
+        train_start = 0 if anchored else start
+        folds.append((train_start, start + train, start + train, start + train + test))
+        start += step
+    return folds
+
+
+def param_sets(grid=None):
+    grid = grid or PARAM_GRID
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def _init_worker(data):
+    global _data
+    _data = data
+    _bands.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _bands(length, ma_type, mult):
+    return indicators.bollinger_bands(_data["close"], length, ma_type, mult, _data["volume"])
+
+
+def _evaluate(params, start, end, fee):
+    open_time = _data["open_time"]
+    signals = backtest.bollinger_signals(open_time, _data["close"], *_bands(**params),
+                                         start_ts=open_time[start], end_ts=open_time[end - 1])
+    return backtest.trade_returns(signals, fee)
+
+
+def _run_fold(args):
+    index, fold, grid, objective, min_trades, fee = args
+    train_start, train_end, test_start, test_end = fold
+    best = None
+    for params in grid:
+        stats = backtest.metrics(_evaluate(params, train_start, train_end, fee))
+        if stats["trades"] < min_trades:
+            continue
+        if best is None or stats[objective] > best[1][objective]:
+            best = (params, stats)
+    if best is None:
+        return {"fold": index, "bounds": fold, "params": None, "train": None,
+                "test": backtest.metrics([]), "test_returns": np.empty(0)}
+    params, train_stats = best
+    returns = _evaluate(params, test_start, test_end, fee)
+    return {"fold": index, "bounds": fold, "params": params, "train": train_stats,
+            "test": backtest.metrics(returns), "test_returns": returns}
+
+
+def walk_forward(data, train, test, step=None, anchored=False, grid=None, objective="sharpe",
+                 min_trades=3, fee=0.0, workers=None):
+    """
+    Run walk-forward validation over a dict of kline arrays.
+    Returns (fold_results, aggregate) where aggregate holds the out-of-sample
+    metrics of all test windows chained together.
+    """
+    folds = make_folds(len(data["close"]), train, test, step, anchored)
+    params = param_sets(grid)
+    jobs = [(i, fold, params, objective, min_trades, fee) for i, fold in enumerate(folds)]
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data,)) as pool:
+        results = list(pool.map(_run_fold, jobs))
+    returns = np.concatenate([r["test_returns"] for r in results]) if results else np.empty(0)
+    aggregate = backtest.metrics(returns)
+    aggregate["folds"] = len(results)
+    aggregate["profitable_folds"] = sum(1 for r in results if r["test"]["total_return"] > 0)
+    return results, aggregate
+
+
+def main():
+    if len(sys.argv) not in (4, 5):
+        print("Error: invalid arguments!!\nYou need HISTORY TRAIN_BARS TEST_BARS [WORKERS]")
+        quit()
+    data = load_history(sys.argv[1])
+    workers = int(sys.argv[4]) if len(sys.argv) == 5 else None
+    results, aggregate = walk_forward(data, int(sys.argv[2]), int(sys.argv[3]), workers=workers)
+    for r in results:
+        test = r["test"]
+        print(f"Fold {r['fold']}: params={r['params']} trades={test['trades']} "
+              f"return={test['total_return']:.4f} sharpe={test['sharpe']:.2f} maxDD={test['max_drawdown']:.4f}")
+    print(f"Out-of-sample: {aggregate}")
+
+
+if __name__ == '__main__':
+    main()